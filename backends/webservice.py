@@ -0,0 +1,145 @@
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger("moodle_scraper")
+
+HTML_EXT = ".html"
+HTML_PARSER = "html.parser"
+# Token service of the Moodle mobile app, enabled on most instances
+MOBILE_SERVICE = "moodle_mobile_app"
+# Modules whose files the HTML scraper lists; the contents of pages and books (index.html, images) are not files
+FILE_MODULES = ("resource", "folder")
+TOKEN_PARAM = re.compile(r"((?:ws)?token=)[^&\s]+")
+
+
+def redact_token(text: str) -> str:
+    """
+    Hide web service tokens in a message (e.g. an HTTP error quoting the URL of the request)
+    """
+    return TOKEN_PARAM.sub(r"\1<token>", text)
+
+
+class WebServiceBackend:
+    """
+    Courses and files from Moodle's REST web services (core_enrol_get_users_courses,
+    core_course_get_contents and mod_assign_get_submission_status) instead of scraping the theme's HTML:
+    one compact JSON call per course, and one per assignment for the files of its submission
+    """
+
+    def __init__(self, session: requests.Session, moodle_url: str, token: Optional[str] = None):
+        self.session: requests.Session = session
+        self.moodle_url: str = moodle_url
+        self.token: Optional[str] = token
+        self.course_ids: Dict[str, int] = {}
+        # File link -> size in bytes and modification time, as reported by Moodle
+        self.file_sizes: Dict[str, int] = {}
+        self.file_times: Dict[str, int] = {}
+
+    def login(self, username: str, password: str) -> str:
+        result = self.session.post(
+            f"{self.moodle_url}login/token.php",
+            data={"username": username, "password": password, "service": MOBILE_SERVICE},
+            verify=False,
+        ).json()
+        if "token" not in result:
+            raise RuntimeError(
+                f"Could not get a web service token: {result.get('error', result)}")
+        self.token = result["token"]
+        return self.token
+
+    def call(self, function: str, **params):
+        result = self.session.post(
+            f"{self.moodle_url}webservice/rest/server.php",
+            data={"wstoken": self.token, "wsfunction": function,
+                  "moodlewsrestformat": "json", **params},
+            verify=False,
+        )
+        result.raise_for_status()
+        data = result.json()
+        if isinstance(data, dict) and "exception" in data:
+            raise RuntimeError(
+                f"{function} failed: {data.get('errorcode')} | {data.get('message')}")
+        return data
+
+    def get_courses(self) -> Dict[str, str]:
+        user_id = self.call("core_webservice_get_site_info")["userid"]
+        courses_dict: Dict[str, str] = {}
+        for course in self.call("core_enrol_get_users_courses", userid=user_id):
+            course_name = course["fullname"].strip()
+            courses_dict[course_name] = f"{self.moodle_url}course/view.php?id={course['id']}"
+            self.course_ids[course_name] = course["id"]
+        return courses_dict
+
+    def get_course_files(self, course: str) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Paragraphs of the section summaries and files of a course, named like the HTML scraper names them
+        """
+        text_list: List[str] = []
+        files_dict: Dict[str, str] = {}
+        assignments: List[int] = []
+        for section in self.call("core_course_get_contents", courseid=self.course_ids[course]):
+            summary = BeautifulSoup(section.get("summary") or "", HTML_PARSER)
+            text_list.extend(text_block.getText() for text_block in summary.find_all("p"))
+
+            for module in section.get("modules", []):
+                if module.get("modname") in ("assign", "quiz") and module.get("url"):
+                    files_dict[f"{module['name'].strip()}{HTML_EXT}"] = module["url"]
+                if module.get("modname") == "assign" and module.get("instance"):
+                    assignments.append(module["instance"])
+                if module.get("modname") not in FILE_MODULES:
+                    continue
+                files = [content for content in module.get("contents", [])
+                         if content.get("type") == "file"]
+                for content in files:
+                    if module.get("modname") == "resource" and len(files) == 1:
+                        # Single file resources keep the activity name, as on the course page
+                        file_name = module["name"].strip() + \
+                            os.path.splitext(content["filename"])[1]
+                    else:
+                        file_name = content["filename"]
+                    self._add_file(files_dict, file_name, content)
+
+        # The submitted files, which the HTML scraper finds on the page of each assignment
+        for assignment in assignments:
+            for content in self.get_submission_files(assignment):
+                self._add_file(files_dict, content["filename"], content)
+
+        text_list = [text.replace("\xa0", " ") for text in text_list]
+        return list(dict.fromkeys(text_list)), files_dict
+
+    def get_submission_files(self, assignment) -> List[Dict]:
+        """
+        Files of the user's (or the user's team) submission to an assignment, by its instance id
+        """
+        try:
+            status = self.call("mod_assign_get_submission_status", assignid=assignment)
+        except RuntimeError as e:
+            logger.info("Could not get the submission of assignment %s | %s", assignment, e)
+            return []
+        attempt = status.get("lastattempt") or {}
+        files: List[Dict] = []
+        for submission in (attempt.get("submission"), attempt.get("teamsubmission")):
+            for plugin in (submission or {}).get("plugins", []):
+                for area in plugin.get("fileareas", []):
+                    files += area.get("files", [])
+        return files
+
+    def _add_file(self, files_dict: Dict[str, str], file_name: str, content: Dict) -> None:
+        file_link = content["fileurl"]
+        files_dict[file_name] = file_link
+        self.file_sizes[file_link] = content.get("filesize", 0)
+        self.file_times[file_link] = content.get("timemodified", 0)
+
+    def download_params(self, link: str) -> Dict[str, str]:
+        """
+        Query parameters authenticating a download: the token is only added to the request, so that it is
+        never part of a link that is logged or recorded in the manifest
+        """
+        if "/webservice/pluginfile.php/" in link:
+            return {"token": self.token}
+        return {}
@@ -0,0 +1,94 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Union
+from urllib.parse import urlsplit
+
+from downloader import Downloader, load_config
+from network.rate_limiter import AdaptiveLimiter, HostLimiter, RateLimiter
+
+logger = logging.getLogger("moodle_scraper")
+
+BATCH_FILE = "batch.json"
+
+
+class BatchRunner:
+    """
+    Archive several accounts (or Moodle instances) in one process: `accounts_at_once` accounts are crawled
+    at the same time, and all their downloads share one pool of `workers` threads, one rate limiter
+    and one limit of concurrent downloads per host (adapted to the server, up to `downloads_per_host`)
+    """
+
+    def __init__(self, batch: Dict):
+        defaults: Dict = batch.get("defaults", {})
+        self.accounts: List[Dict] = [{**defaults, **account} for account in batch["accounts"]]
+        self.accounts_at_once: int = batch.get("accounts_at_once", 2)
+        self.workers: int = batch.get("workers", 16)
+        self.rate_limiter: RateLimiter = RateLimiter(
+            batch.get("requests_per_second", 0), batch.get("burst", 1))
+        downloads_per_host: int = batch.get("downloads_per_host", 4)
+        self.host_limiter: Union[HostLimiter, AdaptiveLimiter] = (
+            AdaptiveLimiter(downloads_per_host) if batch.get("throttling", "adaptive") == "adaptive"
+            else HostLimiter(downloads_per_host))
+
+    def run(self) -> List[Dict]:
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download")
+        try:
+            with ThreadPoolExecutor(max_workers=self.accounts_at_once, thread_name_prefix="account") as accounts:
+                results = list(accounts.map(
+                    lambda account: self._run_account(account, executor), self.accounts))
+        finally:
+            executor.shutdown()
+        self._log_report(results, time.perf_counter() - start)
+        return results
+
+    def _run_account(self, account: Dict, executor: ThreadPoolExecutor) -> Dict:
+        name = f"{account.get('user')}@{urlsplit(account.get('baseurl', '')).netloc}"
+        start = time.perf_counter()
+        status = "ok"
+        dl = Downloader(config=account)
+        dl.executor = executor
+        dl.shared_executor = True
+        dl.rate_limiter = self.rate_limiter
+        dl.host_limiter = self.host_limiter
+        # Progress lines of accounts running at the same time would overwrite each other
+        dl.progress = None
+        try:
+            dl.run(show_welcome=False)
+        except SystemExit as e:
+            # Login failures and accounts without courses stop their own run only
+            status = f"stopped ({e.code})"
+        except Exception as e:
+            logger.error("Archiving %s failed | %s", name, str(e))
+            status = f"failed ({type(e).__name__})"
+        return {
+            "account": name,
+            "status": status,
+            "courses": len(dl.courses),
+            "files": dl.downloaded_files,
+            "bytes": dl.downloaded_bytes,
+            "seconds": time.perf_counter() - start,
+        }
+
+    def _log_report(self, results: List[Dict], elapsed: float) -> None:
+        for result in results:
+            logger.info(
+                "%s: %s, %s courses, %s files, %.1f MB in %.1f s",
+                result["account"], result["status"], result["courses"], result["files"],
+                result["bytes"] / 1e6, result["seconds"],
+            )
+        files = sum(result["files"] for result in results)
+        size = sum(result["bytes"] for result in results)
+        logger.info(
+            "Batch: %s accounts, %s files, %.1f MB in %.1f s (%.1f files/s, %.2f MB/s)",
+            len(results), files, size / 1e6, elapsed,
+            files / elapsed if elapsed else 0, size / 1e6 / elapsed if elapsed else 0,
+        )
+
+
+def load_batch(file: str = BATCH_FILE) -> Dict:
+    """
+    A batch file is a scraper.json with a list of `accounts` (each one a scraper.json); shared settings go in `defaults`
+    """
+    return load_config(file)
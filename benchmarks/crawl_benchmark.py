@@ -0,0 +1,68 @@
+"""
+Discovery time of Downloader.get_courses + get_files with 1 vs. N crawl workers, for the HTML and the
+web service backends, against a local fake Moodle server with injected latency; for each backend the
+discovered files and paragraphs must not depend on the number of workers, and both backends must find
+the same file names
+
+Usage (from the repository root):
+    python benchmarks/crawl_benchmark.py [--courses N] [--latency SECONDS] [--backend NAME] [workers ...]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_moodle import FakeMoodle, FakeSite  # noqa: E402
+from downloader import Downloader  # noqa: E402
+
+
+def crawl(server, backend, crawl_workers):
+    dl = Downloader(config=server.config(crawl_workers=crawl_workers))
+    dl.session = dl.new_session()
+    requests_before = server.site.requests
+    start = time.perf_counter()
+    if backend == "webservice":
+        dl.token = None
+        dl.webservice = dl.get_webservice()
+    dl.courses = dl.get_courses()
+    dl.get_files()
+    elapsed = time.perf_counter() - start
+    return elapsed, server.site.requests - requests_before, dl.files, dl.paragraphs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("workers", nargs="*", type=int, default=[1, 4, 16])
+    parser.add_argument("--courses", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--backend", choices=["html", "webservice"], action="append")
+    args = parser.parse_args()
+    logging.getLogger("moodle_scraper").setLevel(logging.WARNING)
+
+    site = FakeSite(courses=args.courses, assignments=2, latency=args.latency)
+    print(f"courses={args.courses} latency={args.latency}s")
+    print(f"{'backend':>10} {'workers':>8} {'discovery (s)':>14} {'requests':>9} {'files':>6} {'identical':>10}")
+    names = {}
+    with FakeMoodle(site) as server, tempfile.TemporaryDirectory() as tmp:
+        # The filters of an excluded-courses.ini in the working directory must not apply
+        os.chdir(tmp)
+        for backend in args.backend or ["html", "webservice"]:
+            reference = None
+            for workers in args.workers:
+                elapsed, request_count, files, paragraphs = crawl(server, backend, workers)
+                result = (list(files.items()), list(paragraphs.items()))
+                reference = reference or result
+                file_count = sum(len(links) for links in files.values())
+                print(f"{backend:>10} {workers:>8} {elapsed:>14.2f} {request_count:>9} {file_count:>6} "
+                      f"{str(result == reference):>10}")
+            names[backend] = {course: sorted(links) for course, links in reference[0]}
+    if len(names) > 1:
+        assert names["html"] == names["webservice"], "the backends found different files"
+
+
+if __name__ == "__main__":
+    main()
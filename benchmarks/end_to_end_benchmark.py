@@ -0,0 +1,110 @@
+"""
+Downloader.run end to end (HTTP login, course list, crawl, downloads) against a local fake Moodle server:
+wall time, peak RSS of the downloader process and requests served, for a first sync and for an
+incremental sync of the same directory; the stage times of the run are printed with --stages
+
+Usage (from the repository root):
+    python benchmarks/end_to_end_benchmark.py [--courses N] [--files N] [--sizes BYTES ...] [--latency SECONDS]
+        [--sections N] [--engine NAME] [--backend NAME] [--workers N] [--page-cache-ttl SECONDS] [--stages] [--json]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_moodle import FakeMoodle, FakeSite  # noqa: E402
+
+CREDENTIALS = ("benchmark", "benchmark")
+
+
+def child(config):
+    """
+    One run in its own process, so that its peak RSS is not mixed with the server's
+    """
+    import logging
+    from downloader import Downloader
+
+    logging.getLogger("moodle_scraper").setLevel(logging.WARNING)
+    dl = Downloader(config=json.loads(config))
+    dl.run(show_welcome=False)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "peak_rss_mb": round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1),
+        "metrics": dl.get_metrics(),
+    }))
+
+
+def sync(server, config, directory):
+    site = server.site
+    requests_before, bytes_before = site.requests, site.bytes_sent
+    start = time.perf_counter()
+    # The log file and debug dumps are written in the working directory
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", json.dumps(config)],
+        check=True, capture_output=True, text=True, cwd=directory,
+    )
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result["wall_seconds"] = round(time.perf_counter() - start, 3)
+    result["requests"] = site.requests - requests_before
+    result["bytes_sent"] = site.bytes_sent - bytes_before
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--courses", type=int, default=10)
+    parser.add_argument("--files", type=int, default=20, help="files per course page")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16 * 1024, 256 * 1024, 4 * 1024 * 1024],
+                        help="file sizes in bytes, spread over the files")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--sections", type=int, default=0, help="section pages per course")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--backend", choices=["html", "webservice"], default="html")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--page-cache-ttl", type=float, default=0,
+                        help="pages of the first sync younger than this are not requested by the incremental one")
+    parser.add_argument("--stages", action="store_true", help="print the time spent in each stage")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    site = FakeSite(courses=args.courses, files=args.files, folder_files=args.files // 4, assignments=2,
+                    file_size=args.sizes, latency=args.latency, credentials=CREDENTIALS, sections=args.sections)
+    results = {}
+    with FakeMoodle(site) as server, tempfile.TemporaryDirectory() as tmp:
+        config = server.config(directory=tmp, engine=args.engine, backend=args.backend, workers=args.workers,
+                               login_mode="http", page_cache_ttl=args.page_cache_ttl)
+        for run in ("first", "incremental"):
+            results[run] = sync(server, config, tmp)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"courses={args.courses} files={args.files} sizes={args.sizes} latency={args.latency}s "
+          f"engine={args.engine} backend={args.backend} workers={args.workers}")
+    print(f"{'sync':>12} {'wall time (s)':>14} {'peak RSS (MB)':>14} {'requests':>9} {'files':>6} {'MB sent':>8} "
+          f"{'cached pages':>13}")
+    for run, result in results.items():
+        page_cache = result["metrics"]["page_cache"]
+        print(f"{run:>12} {result['wall_seconds']:>14.2f} {result['peak_rss_mb']:>14.1f} {result['requests']:>9} "
+              f"{result['metrics']['downloads']['files']:>6} {result['bytes_sent'] / 1e6:>8.1f} "
+              f"{page_cache['hits'] + page_cache['revalidated']:>13}")
+    if args.stages:
+        for run, result in results.items():
+            print(f"\n{run} sync: {'stage':>14} {'calls':>6} {'seconds':>8} {'wall (s)':>9}")
+            for name, stage in result["metrics"]["stages"].items():
+                print(f"{'':>11} {name:>14} {stage['calls']:>6} {stage['seconds']:>8.2f} {stage['wall_seconds']:>9.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,125 @@
+"""
+Thread engine vs. asyncio engine: wall time, files per second and peak thread count of Downloader.save_files
+for many small files, against a local aiohttp stub server with injected latency
+
+Usage (from the repository root):
+    python benchmarks/engine_benchmark.py [--latency SECONDS] [--workers N] [--size BYTES] [counts ...]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web  # noqa: E402
+
+from downloader import Downloader  # noqa: E402
+
+
+class StubServer:
+    """
+    aiohttp file server: /pluginfile.php/<size>/<name> answers <size> bytes after `latency` seconds
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.runner = None
+        self.port = None
+
+    async def handle(self, request):
+        await asyncio.sleep(self.latency)
+        return web.Response(body=b"x" * int(request.match_info["size"]))
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get("/pluginfile.php/{size}/{name}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0, backlog=4096)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def __enter__(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def file_url(self, size, name):
+        return f"http://127.0.0.1:{self.port}/pluginfile.php/{size}/{name}"
+
+    def config(self, **settings):
+        return {"user": "", "pwd": "", "baseurl": f"http://127.0.0.1:{self.port}/", "directory": "",
+                "session_cache": "", "requests_per_second": 0, **settings}
+
+
+class ThreadMonitor:
+    def __init__(self):
+        self.peak = threading.active_count()
+        self.running = True
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while self.running:
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(0.005)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+
+
+def run(server, engine, count, workers, size):
+    with tempfile.TemporaryDirectory() as tmp:
+        dl = Downloader(config=server.config(
+            directory=tmp, engine=engine, workers=workers, pool_size=workers, connections_per_host=workers,
+            deduplicate=False))
+        dl.session = dl.new_session()
+        dl.files = {"course": {f"file{i}.pdf": server.file_url(size, f"file{i}.pdf") for i in range(count)}}
+        dl.create_saving_directory()
+
+        with ThreadMonitor() as monitor:
+            start = time.perf_counter()
+            dl.save_files()
+            dl.clean_up_threads()
+            elapsed = time.perf_counter() - start
+
+        assert len([name for name in os.listdir(f"{tmp}/course") if name.endswith(".pdf")]) == count
+    return elapsed, monitor.peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("counts", nargs="*", type=int, default=[100, 1000, 3000])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=64,
+                        help="threads of the thread engine, connections of the asyncio engine")
+    parser.add_argument("--size", type=int, default=4 * 1024)
+    args = parser.parse_args()
+    logging.getLogger("moodle_scraper").setLevel(logging.WARNING)
+
+    print(f"latency={args.latency}s workers={args.workers} size={args.size}B")
+    print(f"{'engine':>8} {'files':>6} {'wall time (s)':>14} {'files/s':>9} {'peak threads':>13}")
+    with StubServer(args.latency) as server:
+        for count in args.counts:
+            for engine in ("threads", "asyncio"):
+                elapsed, threads = run(server, engine, count, args.workers, args.size)
+                print(f"{engine:>8} {count:>6} {elapsed:>14.2f} {count / elapsed:>9.1f} {threads:>13}")
+
+
+if __name__ == "__main__":
+    main()
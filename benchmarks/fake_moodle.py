@@ -0,0 +1,533 @@
+import hashlib
+import json
+import re
+import secrets
+import threading
+import time
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs, urlsplit
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FakeSite:
+    """
+    Generated Moodle content: `courses` courses with `files` files, `folder_files` folder entries
+    and `assignments` assignment pages (each with `assignment_files` submissions) per course;
+    and `shared_files` folder entries linked from every course (the same pluginfile items);
+    with `sections`, courses show one section per page: the course page links to `sections` section pages
+    of `section_files` files each, and every section page links back to the course and to all the sections;
+    with `credentials` (username, password), every page requires a MoodleSession from the login form;
+    `file_size` is the size of every file, or a list of sizes spread over the files;
+    with `capacity`, file downloads slow down as more of them run at the same time (`latency` is divided
+    by the share of the capacity left), and beyond `capacity` the server answers
+    503 with a Retry-After of `retry_after` seconds; with `bandwidth`, each download is sent at most at
+    this many bytes per second
+    """
+
+    def __init__(self, courses=3, files=5, folder_files=2, assignments=1, assignment_files=2,
+                 file_size=16 * 1024, latency=0.0, credentials=None, shared_files=0, sections=0, section_files=2,
+                 capacity=None, retry_after=1, bandwidth=None):
+        self.courses = courses
+        self.files = files
+        self.folder_files = folder_files
+        self.assignments = assignments
+        self.assignment_files = assignment_files
+        self.file_size = file_size
+        self.latency = latency
+        self.credentials = credentials
+        self.shared_files = shared_files
+        self.sections = sections
+        self.section_files = section_files
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.bandwidth = bandwidth
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.throttled = 0
+        self.sessions = set()
+        self.login_tokens = set()
+        # Web service token handed out by /login/token.php
+        self.token = secrets.token_hex(16)
+        # When set, file downloads are cut after this many bytes, as if the connection dropped
+        self.drop_after = None
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        # file name -> version, bump it to simulate a file updated on Moodle
+        self.versions = {}
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_bytes(self, size, not_modified=False):
+        with self._lock:
+            self.bytes_sent += size
+            self.not_modified += not_modified
+
+    def start_download(self) -> bool:
+        """
+        Count a download in flight, return False if the server is over capacity
+        """
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            over_capacity = self.capacity is not None and self.in_flight > self.capacity
+            self.throttled += over_capacity
+            in_flight = self.in_flight
+        if self.capacity is not None and not over_capacity:
+            # Like a queue: the closer to its capacity, the slower the server
+            time.sleep(self.latency / (1 - in_flight / (self.capacity + 1)))
+        return not over_capacity
+
+    def end_download(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def validators(self, name):
+        return f'"{name}-{self.versions.get(name, 0)}"', formatdate(self.modified_time(name), usegmt=True)
+
+    def modified_time(self, name) -> int:
+        # Files are "last modified" one day apart for every version, starting on 2023-01-01
+        return 1672531200 + self.versions.get(name, 0) * 86400
+
+    def login_page(self) -> str:
+        token = secrets.token_hex(8)
+        with self._lock:
+            self.login_tokens.add(token)
+        return (
+            '<html><body><form action="/login/index.php" method="post" id="login">'
+            f'<input type="hidden" name="logintoken" value="{token}">'
+            '<input type="text" name="username" id="username">'
+            '<input type="password" name="password" id="password">'
+            '<button type="submit" id="loginbtn">Log in</button>'
+            '</form></body></html>'
+        )
+
+    def login(self, form) -> str:
+        """
+        Return a new session id if the posted form is valid
+        """
+        with self._lock:
+            token_is_valid = form.get("logintoken") in self.login_tokens
+            self.login_tokens.discard(form.get("logintoken"))
+        if not token_is_valid or (form.get("username"), form.get("password")) != self.credentials:
+            return ""
+        session = secrets.token_hex(16)
+        with self._lock:
+            self.sessions.add(session)
+        return session
+
+    def webservice(self, base, form):
+        """
+        JSON answer of /webservice/rest/server.php for the same generated content as the HTML pages
+        """
+        if form.get("wstoken") != self.token:
+            return {"exception": "moodle_exception", "errorcode": "invalidtoken", "message": "Invalid token"}
+        function = form.get("wsfunction")
+        if function == "core_webservice_get_site_info":
+            return {"userid": 2, "sitename": "Fake Moodle"}
+        if function == "core_enrol_get_users_courses":
+            return [{"id": course, "fullname": f"Course {course}"} for course in range(self.courses)]
+        if function == "core_course_get_contents":
+            return self._course_contents(base, form["courseid"])
+        if function == "mod_assign_get_submission_status":
+            return self._submission_status(base, form["assignid"])
+        return {"exception": "moodle_exception", "errorcode": "invalidfunction", "message": function}
+
+    def _course_contents(self, base, course):
+        def file_content(name, filename):
+            return {"type": "file", "filename": filename, "filesize": self.size_of(name),
+                    "timemodified": self.modified_time(name),
+                    "fileurl": self.file_link(f"{base}webservice/", name) + "?forcedownload=1"}
+
+        modules = [
+            {"modname": "resource", "name": f"Lecture {course}-{i}",
+             "contents": [file_content(f"c{course}f{i}.pdf", f"c{course}f{i}.pdf")]}
+            for i in range(self.files)
+        ]
+        modules += [
+            {"modname": "assign", "name": f"Assignment {course}-{i}", "instance": f"{course}-{i}",
+             "url": f"{base}mod/assign/view.php?id={course}-{i}"}
+            for i in range(self.assignments)
+        ]
+        # The contents of a page, which are not files of the course
+        modules.append({
+            "modname": "page", "name": f"Page {course}", "url": f"{base}mod/page/view.php?id={course}",
+            "contents": [{"type": "file", "filename": "index.html", "filesize": 100, "timemodified": 1672531200,
+                          "fileurl": f"{base}webservice/pluginfile.php/{course}/mod_page/content/index.html"}],
+        })
+        modules.append({
+            "modname": "folder", "name": "Folder",
+            "contents": [file_content(f"c{course}d{i}.pdf", f"Folder file {course}-{i}.pdf")
+                         for i in range(self.folder_files)],
+        })
+        summary = f"<p>About course {course}</p><p>Exam\xa0dates</p>"
+        sections = [{"id": 1, "name": "General", "summary": summary, "modules": modules}]
+        sections += [
+            {"id": section + 1, "name": f"Section {section}", "summary": "", "modules": [
+                {"modname": "resource", "name": f"Lecture {course}-{section}-{i}",
+                 "contents": [file_content(f"c{course}s{section}f{i}.pdf", f"c{course}s{section}f{i}.pdf")]}
+                for i in range(self.section_files)
+            ]}
+            for section in range(1, self.sections + 1)
+        ]
+        return sections
+
+    def _submission_status(self, base, assignment):
+        """
+        The submission of an assignment: the same files as on its page
+        """
+        files = [
+            {"filepath": "/", "filename": f"Submission {assignment}-{i}.pdf",
+             "filesize": self.size_of(f"a{assignment}s{i}.pdf"),
+             "timemodified": self.modified_time(f"a{assignment}s{i}.pdf"),
+             "fileurl": self.file_link(f"{base}webservice/", f"a{assignment}s{i}.pdf")}
+            for i in range(self.assignment_files)
+        ]
+        plugin = {"type": "file", "name": "File submissions",
+                  "fileareas": [{"area": "submission_files", "files": files}]}
+        return {"lastattempt": {"submission": {"status": "submitted", "plugins": [plugin]}}}
+
+    def file_link(self, base, name, size=None) -> str:
+        return f"{base}pluginfile.php/{self.size_of(name) if size is None else size}/{name}"
+
+    def size_of(self, name) -> int:
+        if isinstance(self.file_size, int):
+            return self.file_size
+        return self.file_size[zlib.crc32(name.encode()) % len(self.file_size)]
+
+    def home_page(self, base) -> str:
+        items = "".join(
+            f'<li><a href="{base}course/view.php?id={course}">'
+            f'<span class="media-body">Course {course}</span></a></li>'
+            for course in range(self.courses)
+        )
+        # The user menu of a logged-in user
+        logout = f'<a href="{base}login/logout.php?sesskey=fakesesskey">Log out</a>'
+        return f'<html><body>{logout}<div id="nav-drawer"><nav><ul>{items}</ul></nav></div></body></html>'
+
+    def _pdf_activities(self, base, names) -> str:
+        return "".join(
+            f'<div class="activityinstance"><a href="{self.file_link(base, f"{name}.pdf")}">'
+            f'<img src="{base}theme/image.php/boost/core/1/f/pdf-24">'
+            f'<span class="instancename">{label}<span class="accesshide"> File</span></span>'
+            f'</a></div>'
+            for name, label in names
+        )
+
+    def _section_links(self, base, course) -> str:
+        return "".join(
+            f'<h3 class="sectionname"><a href="{base}course/view.php?id={course}&section={section}">'
+            f'Section {section}</a></h3>'
+            for section in range(1, self.sections + 1)
+        )
+
+    def course_page(self, base, course) -> str:
+        activities = self._pdf_activities(
+            base, [(f"c{course}f{i}", f"Lecture {course}-{i}") for i in range(self.files)])
+        activities += "".join(
+            f'<div class="activityinstance"><a href="{base}mod/assign/view.php?id={course}-{i}">'
+            f'<img src="{base}theme/image.php/boost/assign/1/icon">'
+            f'<span class="instancename">Assignment {course}-{i}</span></a></div>'
+            for i in range(self.assignments)
+        )
+        folder = "".join(
+            f'<span class="fp-filename-icon"><a href="{self.file_link(base, f"c{course}d{i}.pdf")}">'
+            f'<span class="fp-filename">Folder file {course}-{i}.pdf</span></a></span>'
+            for i in range(self.folder_files)
+        )
+        folder += "".join(
+            f'<span class="fp-filename-icon"><a href="{self.file_link(base, f"shared{i}.pdf")}?forcedownload=1">'
+            f'<span class="fp-filename">Shared file {i}.pdf</span></a></span>'
+            for i in range(self.shared_files)
+        )
+        text = f'<div class="no-overflow"><p>About course {course}</p><p>Exam\xa0dates</p></div>'
+        return (f'<html><body class="format-topics course-{course}">{text}{activities}{folder}'
+                f'{self._section_links(base, course)}</body></html>')
+
+    def section_page(self, base, course, section) -> str:
+        """
+        Section page of a course showing one section per page, with links to the previous and next sections,
+        back to the course, and to every section (many links, and cycles, between few pages)
+        """
+        activities = self._pdf_activities(
+            base, [(f"c{course}s{section}f{i}", f"Lecture {course}-{section}-{i}") for i in range(self.section_files)])
+        navigation = f'<a href="{base}course/view.php?id={course}">Course</a>'
+        if section > 1:
+            navigation = (f'<span class="mdl-left"><a href="{base}course/view.php?section={section - 1}&id={course}">'
+                          f'Previous</a></span>{navigation}')
+        if section < self.sections:
+            navigation += (f'<span class="mdl-right"><a href="{base}course/view.php?id={course}&section={section + 1}'
+                           f'#top">Next</a></span>')
+        return (f'<html><body class="format-topics course-{course}"><div class="section-navigation">{navigation}'
+                f'</div>{activities}{self._section_links(base, course)}</body></html>')
+
+    def assignment_page(self, base, assignment) -> str:
+        submissions = "".join(
+            f'<div class="fileuploadsubmission"><a target="_blank" '
+            f'href="{self.file_link(base, f"a{assignment}s{i}.pdf")}">Submission {assignment}-{i}.pdf</a></div>'
+            for i in range(self.assignment_files)
+        )
+        return f"<html><body>{submissions}</body></html>"
+
+
+class FakeMoodleHandler(BaseHTTPRequestHandler):
+    """
+    Minimal Moodle stand-in: /pluginfile.php/<size>/<name> streams <size> bytes, and the pages
+    of the server's FakeSite (home page, /course/view.php, /mod/assign/view.php) are rendered
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def site(self) -> FakeSite:
+        return self.server.site
+
+    @property
+    def base(self) -> str:
+        return f"http://{self.headers['Host']}/"
+
+    def do_GET(self):
+        self.site.count_request()
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        match = re.match(r"^/(?:webservice/)?pluginfile\.php/(\d+)/(.*)$", url.path)
+        # With a capacity, the latency of downloads is spent while they are counted in flight
+        if self.site.latency and not (match and self.site.capacity is not None):
+            time.sleep(self.site.latency)
+
+        if url.path == "/login/index.php":
+            self._send_html(self.site.login_page())
+            return
+        if not self._is_logged_in():
+            self._redirect("/login/index.php")
+            return
+
+        if match:
+            try:
+                if self.site.start_download():
+                    self._send_file(int(match.group(1)), match.group(2))
+                else:
+                    self.send_response(503)
+                    self.send_header("Retry-After", str(self.site.retry_after))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+            finally:
+                self.site.end_download()
+        elif url.path == "/":
+            self._send_html(self.site.home_page(self.base))
+        elif url.path == "/course/view.php" and "section" in query:
+            section = int(query["section"][0])
+            if 1 <= section <= self.site.sections:
+                self._send_html(self.site.section_page(self.base, query["id"][0], section))
+            else:
+                self.send_error(404)
+        elif url.path == "/course/section.php":
+            # Moodle 4.4 section links, by section id: <course> * 1000 + <section>
+            course, section = divmod(int(query["id"][0]), 1000)
+            if course < self.site.courses and 1 <= section <= self.site.sections:
+                self._send_html(self.site.section_page(self.base, course, section))
+            else:
+                self.send_error(404)
+        elif url.path == "/course/view.php":
+            self._send_html(self.site.course_page(self.base, query["id"][0]))
+        elif url.path == "/mod/assign/view.php":
+            self._send_html(self.site.assignment_page(self.base, query["id"][0]))
+        else:
+            self.send_error(404)
+
+    def do_HEAD(self):
+        """
+        Headers of a file download (its size and validators), without its content
+        """
+        self.site.count_request()
+        if self.site.latency:
+            time.sleep(self.site.latency)
+        match = re.match(r"^/(?:webservice/)?pluginfile\.php/(\d+)/(.*)$", urlsplit(self.path).path)
+        if not self._is_logged_in():
+            self._redirect("/login/index.php")
+            return
+        if not match:
+            self.send_error(404)
+            return
+        etag, last_modified = self.site.validators(match.group(2))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", match.group(1))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+
+    def do_POST(self):
+        self.site.count_request()
+        length = int(self.headers.get("Content-Length", 0))
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        path = urlsplit(self.path).path
+        if path == "/login/token.php":
+            if self.site.credentials in (None, (form.get("username"), form.get("password"))):
+                self._send_json({"token": self.site.token})
+            else:
+                self._send_json({"error": "Invalid login, please try again", "errorcode": "invalidlogin"})
+            return
+        if path == "/webservice/rest/server.php":
+            self._send_json(self.site.webservice(self.base, form))
+            return
+        if path != "/login/index.php":
+            self.send_error(404)
+            return
+        session = self.site.login(form)
+        if not session:
+            self._redirect("/login/index.php")
+            return
+        self._redirect("/", cookie=f"MoodleSession={session}; Path=/")
+
+    def _is_logged_in(self) -> bool:
+        if self.site.credentials is None:
+            return True
+        if parse_qs(urlsplit(self.path).query).get("token") == [self.site.token]:
+            return True
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return "MoodleSession" in cookie and cookie["MoodleSession"].value in self.site.sessions
+
+    def _redirect(self, location, cookie=None):
+        self.send_response(303)
+        self.send_header("Location", location)
+        if cookie:
+            self.send_header("Set-Cookie", cookie)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_html(self, page):
+        body = page.encode("utf-8")
+        etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.site.count_bytes(0, not_modified=True)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _is_not_modified(self, etag, last_modified) -> bool:
+        if "If-None-Match" in self.headers:
+            return self.headers["If-None-Match"] == etag
+        if "If-Modified-Since" in self.headers:
+            try:
+                since = parsedate_to_datetime(self.headers["If-Modified-Since"])
+            except (TypeError, ValueError):
+                return False
+            return parsedate_to_datetime(last_modified) <= since
+        return False
+
+    def _send_file(self, size, name):
+        etag, last_modified = self.site.validators(name)
+        if self._is_not_modified(etag, last_modified):
+            self.site.count_bytes(0, not_modified=True)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start = self._range_start(etag, last_modified)
+        if start is not None and start >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200 if start is None else 206)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size - (start or 0)))
+        if start is not None:
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        remaining = size - (start or 0)
+        if self.site.drop_after is not None:
+            remaining = min(remaining, self.site.drop_after)
+            self.close_connection = True
+        self.site.count_bytes(remaining)
+        # Every file (and version) has its own content, repeating its ETag
+        pattern = etag.encode("utf-8")
+        buffer = pattern * (CHUNK_SIZE // len(pattern) + 2)
+        position = start or 0
+        while remaining > 0:
+            offset = position % len(pattern)
+            chunk = buffer[offset:offset + min(CHUNK_SIZE, remaining)]
+            self.wfile.write(chunk)
+            position += len(chunk)
+            remaining -= len(chunk)
+            if self.site.bandwidth:
+                time.sleep(len(chunk) / self.site.bandwidth)
+
+    def _range_start(self, etag, last_modified):
+        """
+        First byte requested by a "Range: bytes=N-" header, unless If-Range no longer matches
+        """
+        match = re.match(r"^bytes=(\d+)-$", self.headers.get("Range", ""))
+        if not match or self.headers.get("If-Range", etag) not in (etag, last_modified):
+            return None
+        return int(match.group(1))
+
+
+class FakeMoodle:
+    def __init__(self, site=None, handler=FakeMoodleHandler, host="127.0.0.1", port=0):
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.server.site = site or FakeSite()
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+
+    @property
+    def site(self) -> FakeSite:
+        return self.server.site
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def file_url(self, size, name="file.bin") -> str:
+        return self.site.file_link(self.url, name, size)
+
+    def config(self, **settings) -> dict:
+        """
+        Downloader settings (as in scraper.json) for this server, without rate limiting or session cache
+        """
+        user, password = self.site.credentials or ("user", "password")
+        return {"user": user, "pwd": password, "baseurl": self.url, "directory": "",
+                "session_cache": "", "requests_per_second": 0, **settings}
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
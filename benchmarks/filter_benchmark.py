@@ -0,0 +1,91 @@
+"""
+Course and file filtering with thousands of rules: the compiled matcher of configuration/config.py (every rule in
+one regular expression, built once) against checking each name with each rule in turn; the files of excluded
+courses are never crawled, so the crawl requests saved are also printed
+
+Usage (from the repository root):
+    python benchmarks/filter_benchmark.py [--courses N] [--files N] [rules ...]
+"""
+import argparse
+import fnmatch
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configuration.config import Config  # noqa: E402
+
+TOPICS = ["algebra", "analysis", "biology", "chemistry", "databases", "economics", "history", "networks",
+          "physics", "statistics"]
+
+
+def make_rules(count, rng):
+    """
+    Mostly course codes (substrings), with a few globs and regular expressions
+    """
+    rules = [f"cs{number:05d}" for number in rng.sample(range(100000), count)]
+    for i in range(0, count, 50):
+        rules[i] = f"*{TOPICS[i % len(TOPICS)]} {i}*"
+    for i in range(25, count, 100):
+        rules[i] = f"re:^archive {i} - .*20\\d\\d$"
+    return rules
+
+
+def naive_allowed(name, rules):
+    name = name.lower()
+    for rule in rules:
+        if rule.startswith("re:"):
+            if re.search(rule[3:], name, re.IGNORECASE):
+                return False
+        elif any(character in rule for character in "*?["):
+            if fnmatch.fnmatch(name, rule.lower()):
+                return False
+        elif rule in name:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("rules", nargs="*", type=int, default=[10, 1000, 5000])
+    parser.add_argument("--courses", type=int, default=5000)
+    parser.add_argument("--files", type=int, default=20, help="files per course, matched against file rules")
+    args = parser.parse_args()
+    rng = random.Random(0)
+    courses = [f"CS{rng.randrange(100000):05d} {rng.choice(TOPICS).title()} {i} - Autumn 20{rng.randrange(10, 30)}"
+               for i in range(args.courses)]
+    files = [f"Lecture {i}{rng.choice(['.pdf', '.pptx', '.mp4', '.zip'])}" for i in range(args.files * 100)]
+
+    print(f"courses={args.courses} files={len(files)}")
+    print(f"{'rules':>6} {'compile (ms)':>13} {'compiled (ms)':>14} {'one by one (ms)':>16} {'excluded':>9}")
+    for count in args.rules:
+        rules = make_rules(count, rng)
+        config = Config()
+        config.excluded_courses = rules
+        config.excluded_files = rules
+        config.extensions = ["pdf", "pptx"]
+        start = time.perf_counter()
+        config.compile()
+        compile_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        allowed = [course for course in courses if config.course_allowed(course)]
+        allowed_files = [name for name in files if config.file_allowed(name)]
+        compiled_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        naive = [course for course in courses if naive_allowed(course, rules)]
+        naive_files = [name for name in files if os.path.splitext(name)[1] in (".pdf", ".pptx")
+                       and naive_allowed(name, rules)]
+        naive_time = time.perf_counter() - start
+        assert allowed == naive and allowed_files == naive_files
+
+        print(f"{count:>6} {compile_time * 1000:>13.1f} {compiled_time * 1000:>14.1f} {naive_time * 1000:>16.1f} "
+              f"{len(courses) - len(allowed):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Peak RSS of a single download, streamed vs. fully buffered, against a local fake Moodle server
+
+Usage (from the repository root): python benchmarks/memory_benchmark.py [size_in_mb ...]
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_moodle import FakeMoodle  # noqa: E402
+
+DEFAULT_SIZES_MB = [1, 16, 64, 256]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def child(mode, url, destination):
+    from downloader import Downloader
+
+    dl = Downloader(config={"user": "", "pwd": "", "baseurl": url, "directory": "", "session_cache": ""})
+    dl.session = dl.new_session()
+    if mode == "stream":
+        dl._stream_to_file(url, destination)
+    else:
+        with open(destination, "wb") as write_file:
+            write_file.write(dl.session.get(url).content)
+    print(f"{_peak_rss_mb():.1f}")
+
+
+def main(sizes_mb):
+    print(f"{'size (MB)':>10} {'buffered RSS (MB)':>18} {'streamed RSS (MB)':>18}")
+    with FakeMoodle() as server, tempfile.TemporaryDirectory() as tmp:
+        for size_mb in sizes_mb:
+            url = server.file_url(size_mb * 1024 * 1024)
+            results = []
+            for mode in ("buffered", "stream"):
+                output = subprocess.run(
+                    [sys.executable, __file__, "--child", mode, url,
+                     os.path.join(tmp, f"{mode}.bin")],
+                    check=True, capture_output=True, text=True,
+                )
+                results.append(output.stdout.strip().splitlines()[-1])
+            print(f"{size_mb:>10} {results[0]:>18} {results[1]:>18}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(*sys.argv[2:5])
+    else:
+        main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES_MB)
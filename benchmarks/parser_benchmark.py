@@ -0,0 +1,87 @@
+"""
+Course page extraction time: full html.parser parse (old) vs. lxml restricted to the read subtrees (new),
+over saved course pages; both must extract the same files and paragraphs
+
+Usage (from the repository root):
+    python benchmarks/parser_benchmark.py [--repeat N] [saved_course_page.html ...]
+Without pages, generated course pages of increasing size are used.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from benchmarks.fake_moodle import FakeSite  # noqa: E402
+from downloader import Downloader  # noqa: E402
+from parsing.pages import COURSE_PAGE, HTML_PARSER, parse_page  # noqa: E402
+
+BASE = "https://moodle.example.com/"
+
+
+def generated_page(files):
+    """
+    A generated course page, wrapped in the kind of navigation, scripts and footer a real theme renders
+    """
+    content = FakeSite(files=files, folder_files=files // 4, assignments=0).course_page(BASE, 1)
+    navigation = "".join(
+        f'<li class="nav-item"><a class="nav-link" href="{BASE}course/view.php?id={i}">'
+        f'<div class="media"><span class="media-body">Course {i}</span></div></a></li>'
+        for i in range(150)
+    )
+    script = "<script>" + "var M = M || {}; " * 2000 + "</script>"
+    footer = "".join(f'<div class="footer-item"><p>Footer {i}</p></div>' for i in range(200))
+    return (f'<html><head>{script}</head><body><div id="nav-drawer"><nav><ul>{navigation}</ul></nav></div>'
+            f'<div id="page-content">{content.replace("<html><body>", "").replace("</body></html>", "")}'
+            f'</div><footer>{footer}</footer></body></html>')
+
+
+def extract(dl, soup):
+    """
+    Paragraphs and files of a course page, as the crawl reads them (_get_course_page, then _crawl_sections)
+    """
+    return dl._get_paragraphs(soup), dl._resolve_file_entries(dl._get_file_entries(soup))
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("pages", nargs="*")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.getLogger("moodle_scraper").setLevel(logging.WARNING)
+
+    if args.pages:
+        pages = []
+        for page in args.pages:
+            with open(page, encoding="utf-8") as read_file:
+                pages.append((os.path.basename(page), read_file.read()))
+    else:
+        pages = [(f"{files} files", generated_page(files)) for files in (10, 100, 1000)]
+
+    dl = Downloader(config={"user": "", "pwd": "", "baseurl": BASE, "directory": "", "session_cache": ""})
+    # Saved pages are parsed offline: nested assignment pages are not fetched
+    dl._get_nested_files = lambda link: {}
+
+    print(f"new parser: {HTML_PARSER} + SoupStrainer")
+    print(f"{'page':>12} {'size (KB)':>10} {'old (ms)':>9} {'new (ms)':>9} {'speedup':>8} {'identical':>10}")
+    for name, text in pages:
+        old_time, old = timed(lambda: extract(dl, BeautifulSoup(text, "html.parser")), args.repeat)
+        new_time, new = timed(lambda: extract(dl, parse_page(text, COURSE_PAGE)), args.repeat)
+        identical = old[0] == new[0] and list(old[1].items()) == list(new[1].items())
+        print(f"{name[:12]:>12} {len(text) / 1024:>10.0f} {old_time * 1000:>9.1f} {new_time * 1000:>9.1f} "
+              f"{old_time / new_time:>7.1f}x {str(identical):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Download schedules against a local fake Moodle server sending each download at a limited bandwidth: many small
+files and a few large ones found last by the crawl, downloaded in crawl order or, after a HEAD size discovery,
+largest first or interleaved; wall time (size discovery included) and the idle tail of the run, where fewer
+downloads than workers are left running
+
+Usage (from the repository root):
+    python benchmarks/schedule_benchmark.py [--small N] [--large N] [--small-size BYTES] [--large-size BYTES]
+        [--bandwidth BYTES_PER_SECOND] [--workers N] [--latency SECONDS]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_moodle import FakeMoodle, FakeSite  # noqa: E402
+from downloader import Downloader  # noqa: E402
+
+
+def run(schedule, args):
+    site = FakeSite(latency=args.latency, bandwidth=args.bandwidth)
+    with FakeMoodle(site) as server, tempfile.TemporaryDirectory() as tmp:
+        dl = Downloader(config=server.config(directory=tmp, schedule=schedule, workers=args.workers,
+                                             progress=False))
+        dl.session = dl.new_session()
+        # The crawl finds the large files (e.g. lecture recordings) at the end of the last course
+        files = [(f"small{i}.pdf", args.small_size) for i in range(args.small)]
+        files += [(f"large{i}.mp4", args.large_size) for i in range(args.large)]
+        dl.files = {"course": {name: server.file_url(size, name) for name, size in files}}
+        dl.create_saving_directory()
+
+        requests_before = site.requests
+        start = time.perf_counter()
+        if schedule != "crawl":
+            dl.discover_sizes()
+        dl.save_files()
+        # Time at which the last download of each worker ends
+        ends = []
+        for future in dl.futures:
+            future.add_done_callback(lambda _: ends.append(time.perf_counter()))
+        dl.clean_up_threads()
+        elapsed = time.perf_counter() - start
+        ends.sort()
+        tail = ends[-1] - ends[-min(args.workers, len(ends))] if ends else 0.0
+    return elapsed, tail, site.requests - requests_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--small", type=int, default=60)
+    parser.add_argument("--large", type=int, default=2)
+    parser.add_argument("--small-size", type=int, default=512 * 1024)
+    parser.add_argument("--large-size", type=int, default=16 * 1024 * 1024)
+    parser.add_argument("--bandwidth", type=int, default=8 * 1024 * 1024, help="bytes per second of each download")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+    logging.getLogger("moodle_scraper").setLevel(logging.WARNING)
+
+    total = args.small * args.small_size + args.large * args.large_size
+    print(f"small={args.small}x{args.small_size} large={args.large}x{args.large_size} "
+          f"bandwidth={args.bandwidth}/s per download workers={args.workers}")
+    print(f"lower bound: {max(args.large_size / args.bandwidth, total / args.bandwidth / args.workers):.2f}s")
+    print(f"{'schedule':>14} {'wall time (s)':>14} {'tail (s)':>9} {'requests':>9}")
+    for schedule in ("crawl", "largest_first", "interleave"):
+        elapsed, tail, requests = run(schedule, args)
+        print(f"{schedule:>14} {elapsed:>14.2f} {tail:>9.2f} {requests:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Section crawl of courses showing one section per page: every section page links to all the others and back
+to the course, so links grow with the square of the sections while requests must grow with the unique pages;
+against a local fake Moodle server with injected latency
+
+Usage (from the repository root):
+    python benchmarks/section_benchmark.py [--courses N] [--latency SECONDS] [--depth N] [sections ...]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_moodle import FakeMoodle, FakeSite  # noqa: E402
+from downloader import Downloader  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sections", nargs="*", type=int, default=[5, 20, 80])
+    parser.add_argument("--courses", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--depth", type=int, default=2)
+    args = parser.parse_args()
+    logging.getLogger("moodle_scraper").setLevel(logging.WARNING)
+
+    print(f"courses={args.courses} latency={args.latency}s section_depth={args.depth}")
+    print(f"{'sections':>9} {'links':>7} {'pages':>6} {'requests':>9} {'files':>6} {'crawl (s)':>10}")
+    for sections in args.sections:
+        site = FakeSite(courses=args.courses, sections=sections, latency=args.latency)
+        with FakeMoodle(site) as server:
+            dl = Downloader(config=server.config(section_depth=args.depth))
+            dl.session = dl.new_session()
+            dl.courses = dl.get_courses()
+            requests_before = site.requests
+            start = time.perf_counter()
+            dl.get_files()
+            elapsed = time.perf_counter() - start
+
+        # Links to sections on the course page, and on each section page (previous, next and all sections)
+        links = args.courses * (sections + sections * sections + 2 * (sections - 1))
+        pages = args.courses * (1 + sections + site.assignments)
+        files = sum(len(links) for links in dl.files.values())
+        expected_files = args.courses * (site.files + site.assignments * (1 + site.assignment_files)
+                                         + site.folder_files + sections * site.section_files)
+        assert args.depth < 1 or files == expected_files, (files, expected_files)
+        # Every page is requested once, however many links lead to it
+        assert args.depth < 1 or site.requests - requests_before == pages, (site.requests - requests_before, pages)
+        print(f"{sections:>9} {links:>7} {pages:>6} {site.requests - requests_before:>9} {files:>6} {elapsed:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Cold (Selenium login) vs. warm (cached cookies) start of Downloader.get_session
+
+This one needs a real Moodle: it uses the credentials of scraper.json and Chrome's webdriver. The cold start
+always logs in with Selenium (login_mode "selenium"), even where the plain HTTP login would work.
+Usage (from the repository root): python benchmarks/session_benchmark.py
+"""
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader import Downloader, load_config  # noqa: E402
+
+
+def timed_session(dl):
+    start = time.perf_counter()
+    dl.get_session()
+    return time.perf_counter() - start
+
+
+def main():
+    dl = Downloader(config={**load_config(), "login_mode": "selenium"})
+    if not dl.session_cache.file:
+        sys.exit("session_cache is disabled in scraper.json")
+
+    dl.session_cache.clear()
+    cold = timed_session(dl)
+    warm = timed_session(dl)
+    # Includes the children: Chrome and its webdriver only run on the cold start
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    print(f"{'start':>6} {'get_session (s)':>16}")
+    print(f"{'cold':>6} {cold:>16.2f}")
+    print(f"{'warm':>6} {warm:>16.2f}")
+    print(f"peak RSS of the browser processes: {children_rss:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
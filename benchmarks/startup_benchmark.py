@@ -0,0 +1,83 @@
+"""
+Cold start of the command line against a local fake Moodle server: wall time of `python main.py list` with a
+warm session cache (a previous `login`), of `--help`, and of an empty interpreter for reference; with
+--imports, the modules that take the longest to import for `list`
+
+Usage (from the repository root):
+    python benchmarks/startup_benchmark.py [--runs N] [--courses N] [--imports]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_moodle import FakeMoodle, FakeSite  # noqa: E402
+
+MAIN = os.path.join(ROOT, "main.py")
+
+
+def timed(command, directory, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, capture_output=True, cwd=directory)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_times(command, directory, count=8):
+    """
+    Modules with the largest cumulative import time (top-level packages only)
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", *command[1:]], check=True,
+                            capture_output=True, text=True, cwd=directory).stderr
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  "):
+            modules.append((int(cumulative) / 1000, name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--imports", action="store_true", help="print the slowest imports of `list`")
+    args = parser.parse_args()
+
+    site = FakeSite(courses=args.courses, credentials=("benchmark", "benchmark"))
+    with FakeMoodle(site) as server, tempfile.TemporaryDirectory() as tmp:
+        config_file = os.path.join(tmp, "scraper.json")
+        with open(config_file, "w", encoding="utf-8") as write_file:
+            json.dump(server.config(directory=tmp, login_mode="http",
+                                    session_cache=os.path.join(tmp, "session.json")), write_file)
+        subprocess.run([sys.executable, MAIN, "login", "--config", config_file], check=True, cwd=tmp)
+
+        commands = {
+            "python": [sys.executable, "-c", "pass"],
+            "--help": [sys.executable, MAIN, "--help"],
+            "list": [sys.executable, MAIN, "list", "--config", config_file],
+        }
+        print(f"courses={args.courses} runs={args.runs}")
+        print(f"{'command':>8} {'median (ms)':>12} {'min (ms)':>9}")
+        for name, command in commands.items():
+            times = timed(command, tmp, args.runs)
+            print(f"{name:>8} {statistics.median(times) * 1000:>12.0f} {min(times) * 1000:>9.0f}")
+        if args.imports:
+            print("\nslowest imports of `list`:")
+            for cumulative, module in import_times(commands["list"], tmp):
+                print(f"{cumulative:>8.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Fixed vs. adaptive throttling against a local fake Moodle server that slows down as downloads pile up and
+answers 503 (with Retry-After) beyond its capacity: wall time, downloads completed, 503 answers, peak
+concurrency seen by the server and final concurrency limit of the adaptive limiter
+
+Usage (from the repository root):
+    python benchmarks/throttle_simulation.py [--files N] [--workers N] [--capacity N] [--latency SECONDS] [--verbose]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_moodle import FakeMoodle, FakeSite  # noqa: E402
+from downloader import Downloader  # noqa: E402
+
+
+def run(throttling, args):
+    site = FakeSite(capacity=args.capacity, latency=args.latency, retry_after=1)
+    with FakeMoodle(site) as server, tempfile.TemporaryDirectory() as tmp:
+        dl = Downloader(config=server.config(directory=tmp, throttling=throttling, workers=args.workers))
+        dl.session = dl.new_session()
+        dl.files = {"course": {f"file{i}.pdf": server.file_url(64 * 1024, f"file{i}.pdf") for i in range(args.files)}}
+        dl.create_saving_directory()
+
+        start = time.perf_counter()
+        dl.save_files()
+        dl.clean_up_threads()
+        elapsed = time.perf_counter() - start
+
+        completed = len([name for name in os.listdir(f"{tmp}/course") if name.endswith(".pdf")])
+        limit = dl.host_limiter.limit(server.url) if throttling == "adaptive" else args.workers
+    return elapsed, completed, site.throttled, site.peak_in_flight, limit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--capacity", type=int, default=6, help="downloads the server serves at the same time")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--verbose", action="store_true", help="show the decisions of the adaptive limiter")
+    args = parser.parse_args()
+    logging.getLogger("moodle_scraper").setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    print(f"files={args.files} workers={args.workers} capacity={args.capacity} latency={args.latency}s")
+    print(f"{'throttling':>10} {'wall time (s)':>14} {'completed':>10} {'503s':>6} {'peak in flight':>15} "
+          f"{'final limit':>12}")
+    results = {}
+    for throttling in ("fixed", "adaptive"):
+        results[throttling] = elapsed, completed, throttled, peak, limit = run(throttling, args)
+        print(f"{throttling:>10} {elapsed:>14.2f} {completed:>10} {throttled:>6} {peak:>15} {limit:>12}")
+    # Adaptive throttling backs off instead of losing downloads to the 503 answers
+    assert results["adaptive"][1] == args.files, results["adaptive"]
+    if results["fixed"][2]:
+        assert results["adaptive"][2] < results["fixed"][2], (results["adaptive"], results["fixed"])
+
+
+if __name__ == "__main__":
+    main()
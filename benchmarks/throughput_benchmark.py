@@ -0,0 +1,60 @@
+"""
+Wall time and files per second of Downloader.save_files against a local fake Moodle server
+
+Usage (from the repository root):
+    python benchmarks/throughput_benchmark.py [--workers N] [--rps R] [--size BYTES] [counts ...]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_moodle import FakeMoodle  # noqa: E402
+from downloader import Downloader  # noqa: E402
+
+DEFAULT_COUNTS = [10, 100, 1000]
+
+
+def run(server, count, workers, rps, size):
+    with tempfile.TemporaryDirectory() as tmp:
+        dl = Downloader(config=server.config(
+            directory=tmp, workers=workers, pool_size=workers, requests_per_second=rps, burst=workers))
+        dl.session = dl.new_session()
+        dl.files = {
+            "course": {f"file{i}.pdf": server.file_url(size, f"file{i}.pdf") for i in range(count)}
+        }
+        dl.create_saving_directory()
+
+        start = time.perf_counter()
+        dl.save_files()
+        dl.clean_up_threads()
+        elapsed = time.perf_counter() - start
+
+        assert len(os.listdir(f"{tmp}/course")) == count
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("counts", nargs="*", type=int, default=DEFAULT_COUNTS)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rps", type=float, default=0,
+                        help="requests per second per host, 0 for unlimited")
+    parser.add_argument("--size", type=int, default=16 * 1024)
+    args = parser.parse_args()
+    logging.getLogger("moodle_scraper").setLevel(logging.WARNING)
+
+    print(f"workers={args.workers} rps={args.rps or 'unlimited'} size={args.size}B")
+    print(f"{'files':>6} {'wall time (s)':>14} {'files/s':>10}")
+    with FakeMoodle() as server:
+        for count in args.counts:
+            elapsed = run(server, count, args.workers, args.rps, args.size)
+            print(f"{count:>6} {elapsed:>14.2f} {count / elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Verification of a generated archive (many small files, a few large ones, some of them hard linked into a second
+course as the blob store does), with a few files removed, truncated and corrupted: wall time and throughput of
+the size-only check and of the hashing with 1 process and with a process pool. Files just written are in the
+OS page cache, so this measures hashing rather than the disk
+
+Usage (from the repository root):
+    python benchmarks/verify_benchmark.py [--files N] [--size BYTES] [--large N] [--large-size BYTES]
+        [--linked N] [--processes N ...]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage.manifest import Manifest, ManifestEntry  # noqa: E402
+from storage.verify import verify_archive  # noqa: E402
+
+DAMAGED = 3
+
+
+def generate(directory, manifest, args):
+    block = hashlib.sha256(b"block").digest() * (1024 * 1024 // 32)
+    files = [(f"course{i % 50}/file{i}.pdf", args.size) for i in range(args.files)]
+    files += [(f"course{i % 50}/recording{i}.mp4", args.large_size) for i in range(args.large)]
+    for i, (path, size) in enumerate(files):
+        absolute_path = os.path.join(directory, path)
+        os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+        sha256 = hashlib.sha256()
+        with open(absolute_path, "wb") as write_file:
+            header = f"{i}\n".encode()
+            write_file.write(header)
+            sha256.update(header)
+            remaining = size - len(header)
+            while remaining > 0:
+                chunk = block[:remaining]
+                write_file.write(chunk)
+                sha256.update(chunk)
+                remaining -= len(chunk)
+        manifest.record(ManifestEntry(f"https://moodle/pluginfile.php/{i}", path, size, sha256=sha256.hexdigest()))
+        if i < args.linked:
+            linked_path = os.path.join("shared", path)
+            os.makedirs(os.path.dirname(os.path.join(directory, linked_path)), exist_ok=True)
+            os.link(absolute_path, os.path.join(directory, linked_path))
+            manifest.record(ManifestEntry(f"https://moodle/shared/{i}", linked_path, size, sha256=sha256.hexdigest()))
+    return files
+
+
+def damage(directory, files):
+    for path, _ in files[-DAMAGED:]:
+        os.remove(os.path.join(directory, path))
+    for path, size in files[-2 * DAMAGED:-DAMAGED]:
+        with open(os.path.join(directory, path), "r+b") as write_file:
+            write_file.truncate(size // 2)
+    for path, _ in files[-3 * DAMAGED:-2 * DAMAGED]:
+        with open(os.path.join(directory, path), "r+b") as write_file:
+            write_file.seek(1)
+            write_file.write(b"corrupted")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--size", type=int, default=16 * 1024)
+    parser.add_argument("--large", type=int, default=16)
+    parser.add_argument("--large-size", type=int, default=16 * 1024 * 1024)
+    parser.add_argument("--linked", type=int, default=1000, help="files hard linked into a second directory")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+    logging.getLogger("moodle_scraper").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest = Manifest(tmp)
+        files = generate(tmp, manifest, args)
+        damage(tmp, files)
+        total = sum(size for _, size in files)
+        print(f"files={len(files)} (+{args.linked} hard links) size={total / 1e6:.0f} MB cpus={os.cpu_count()}")
+        print(f"{'mode':>12} {'wall time (s)':>14} {'MB/s':>7} {'hashed':>7} {'problems':>9}")
+        runs = [("sizes only", False, 1)] + [(f"hash x{processes}", True, processes) for processes in args.processes]
+        for name, hash_contents, processes in runs:
+            start = time.perf_counter()
+            report = verify_archive(manifest, hash_contents, processes)
+            elapsed = time.perf_counter() - start
+            problems = len(report.damaged)
+            assert problems == (3 if hash_contents else 2) * DAMAGED, problems
+            print(f"{name:>12} {elapsed:>14.2f} {report.hashed_bytes / 1e6 / elapsed:>7.0f} {report.hashed:>7} "
+                  f"{problems:>9}")
+        manifest.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,196 @@
+import fnmatch
 import logging
+import os
+import re
 from configparser import ConfigParser
-from typing import List
+from typing import Dict, List, Optional, Pattern
 
 logger = logging.getLogger("moodle_scraper")
 
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3,
+              "KIB": 1024, "MIB": 1024 ** 2, "GIB": 1024 ** 3}
+
+
+def parse_size(text: str) -> Optional[int]:
+    """
+    "500MB", "1.5 GB", "64KiB" or a number of bytes; None for an empty value
+    """
+    text = text.strip()
+    if not text:
+        return None
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([a-zA-Z]*)", text)
+    if match is None or match.group(2).upper() not in SIZE_UNITS:
+        raise ValueError(f"Invalid size: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def trie_pattern(words: List[str]) -> str:
+    """
+    Regular expression searching for any of the words, factored by common prefixes: at each position of a name,
+    one branch per character is tried instead of one per word
+    """
+    trie: Dict[str, Dict] = {}
+    for word in words:
+        node = trie
+        for character in word.lower():
+            node = node.setdefault(character, {})
+        # A word ending here matches whatever follows it
+        node.clear()
+        node[""] = {}
+    return _trie_node_pattern(trie)
+
+
+def _trie_node_pattern(node: Dict[str, Dict]) -> str:
+    if "" in node:
+        return ""
+    branches: List[str] = [
+        re.escape(character) + _trie_node_pattern(child) for character, child in sorted(node.items())]
+    if len(branches) == 1:
+        return branches[0]
+    if all(len(character) == 1 and "" in child for character, child in node.items()):
+        return f"[{''.join(re.escape(character) for character in sorted(node))}]"
+    return f"(?:{'|'.join(branches)})"
+
+
+def compile_rules(rules: List[str]) -> Optional[Pattern]:
+    """
+    All the rules in one case-insensitive regular expression, so that a name is matched in a single pass:
+    "re:<regex>" as is, globs (with *, ? or [) matching the whole name, and the other rules as plain
+    substrings (None without rules)
+    """
+    if not rules:
+        return None
+    regexes: List[str] = [rule[3:] for rule in rules if rule.startswith("re:")]
+    globs: List[str] = [fnmatch.translate(rule) for rule in rules
+                        if not rule.startswith("re:") and any(character in rule for character in "*?[")]
+    words: List[str] = [rule for rule in rules
+                        if not rule.startswith("re:") and not any(character in rule for character in "*?[")]
+    patterns: List[str] = [f"(?:{regex})" for regex in regexes]
+    if globs:
+        # Only tried at the start of a name
+        patterns.append(f"^(?:{'|'.join(globs)})")
+    if words:
+        patterns.append(trie_pattern(words))
+    return re.compile("|".join(patterns), re.IGNORECASE)
+
+
+class Matcher:
+    """
+    Names allowed by include and exclude rules: a name matching any exclude rule is rejected, and with
+    include rules, a name must match one of them
+    """
+
+    def __init__(self, include: Optional[List[str]] = None, exclude: Optional[List[str]] = None):
+        self.include: Optional[Pattern] = compile_rules(include or [])
+        self.exclude: Optional[Pattern] = compile_rules(exclude or [])
+
+    def __bool__(self) -> bool:
+        return self.include is not None or self.exclude is not None
+
+    def __call__(self, name: str) -> bool:
+        if self.exclude is not None and self.exclude.search(name):
+            return False
+        return self.include is None or self.include.search(name) is not None
+
 
 class Config:
-    CONFIG_FILE: str = "excluded_courses.ini"
+    """
+    Which courses and files are archived, from the [moodlescrap] section of excluded-courses.ini:
+    exclusions / include_courses, exclude_files / include_files (substrings, globs or "re:" regular
+    expressions, matched case-insensitively), extensions / exclude_extensions and min_size / max_size
+    """
+    CONFIG_FILE: str = "excluded-courses.ini"
+    SECTION: str = "moodlescrap"
 
-    def __init__(self):
+    def __init__(self, file: Optional[str] = None):
+        self.file: str = file or Config.CONFIG_FILE
         self.excluded_courses: List[str] = []
+        self.included_courses: List[str] = []
+        self.excluded_files: List[str] = []
+        self.included_files: List[str] = []
+        self.extensions: List[str] = []
+        self.excluded_extensions: List[str] = []
+        self.min_size: Optional[int] = None
+        self.max_size: Optional[int] = None
+        self.courses: Matcher = Matcher()
+        self.files: Matcher = Matcher()
 
     def get_config(self):
-        config_parser: ConfigParser = ConfigParser()
-        config_parser.read(Config.CONFIG_FILE)
+        config_parser: ConfigParser = ConfigParser(interpolation=None)
+        config_parser.read(self.file, encoding="utf-8")
 
         try:
-            self.excluded_courses: List[str] = self._get_exclusions(config_parser)
+            self.excluded_courses = self._get_exclusions(config_parser)
+            self.included_courses = self._get_rules(config_parser, "include_courses")
+            self.excluded_files = self._get_rules(config_parser, "exclude_files")
+            self.included_files = self._get_rules(config_parser, "include_files")
+            self.extensions = [extension.lower().lstrip(".")
+                               for extension in self._get_rules(config_parser, "extensions")]
+            self.excluded_extensions = [extension.lower().lstrip(".")
+                                        for extension in self._get_rules(config_parser, "exclude_extensions")]
+            self.min_size = parse_size(config_parser.get(Config.SECTION, "min_size", fallback=""))
+            self.max_size = parse_size(config_parser.get(Config.SECTION, "max_size", fallback=""))
+            self.compile()
 
         except Exception as e:
             logger.error("Error with config file format | %s", str(e))
             raise SyntaxError
 
+    def compile(self) -> None:
+        """
+        Build the matchers from the rules; call it again after changing them
+        """
+        self.courses = Matcher(self.included_courses, self.excluded_courses)
+        self.files = Matcher(self.included_files, self.excluded_files)
+
     def _get_exclusions(self, config_parser: ConfigParser) -> List[str]:
-        exclusions: List[str] = []
-        if config_parser.has_option("moodlescrap", "exclusions"):
-            exclusions_text = config_parser.get("moodlescrap", "exclusions")
-            if not exclusions_text:
-                logger.info(
-                    "No user defined course exclusions found in %s", Config.CONFIG_FILE
-                )
+        exclusions: List[str] = self._get_rules(config_parser, "exclusions")
+        if not exclusions:
+            logger.info(
+                "No user defined course exclusions found in %s", self.file
+            )
+        else:
+            logger.info(
+                "User defined course exclusions found in %s:", self.file
+            )
+            for text in exclusions:
+                logger.info("%s", text)
+        return exclusions
+
+    def _get_rules(self, config_parser: ConfigParser, option: str) -> List[str]:
+        """
+        Rules separated by commas or new lines; a "re:" rule takes its whole line, commas included
+        """
+        rules: List[str] = []
+        for line in config_parser.get(Config.SECTION, option, fallback="").splitlines():
+            line = line.strip()
+            if line.startswith("re:"):
+                rules.append(line)
             else:
-                exclusions = exclusions_text.lower().split(",")
-                exclusions = [text.strip() for text in exclusions]
-                logger.info(
-                    "User defined course exclusions found in %s:", Config.CONFIG_FILE
-                )
-                for text in exclusions:
-                    logger.info("%s", text)
-        return exclusions
\ No newline at end of file
+                rules += [text.strip() for text in line.split(",") if text.strip()]
+        return rules
+
+    def course_allowed(self, course: str) -> bool:
+        return self.courses(course)
+
+    def file_allowed(self, name: str) -> bool:
+        extension: str = os.path.splitext(name)[1].lower().lstrip(".")
+        if extension in self.excluded_extensions or (self.extensions and extension not in self.extensions):
+            return False
+        return self.files(name)
+
+    @property
+    def has_file_rules(self) -> bool:
+        return bool(self.files or self.extensions or self.excluded_extensions)
+
+    @property
+    def has_size_limits(self) -> bool:
+        return self.min_size is not None or self.max_size is not None
+
+    def size_allowed(self, size: Optional[int]) -> bool:
+        """
+        Files of unknown size are allowed
+        """
+        if size is None:
+            return True
+        return (self.min_size is None or size >= self.min_size) and (self.max_size is None or size <= self.max_size)
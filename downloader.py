@@ -1,99 +1,375 @@
-import concurrent.futures
+import hashlib
 import json
 import logging
 import os
 import pathlib
 import re
 import sys
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import replace
+from email.utils import formatdate, parsedate_to_datetime
+from functools import partial
 from os import path
-from random import randint
-from threading import Thread
-from time import sleep
-from typing import Dict, List
+from typing import Callable, Dict, List, Mapping, Optional, Set, Tuple, Union
+from urllib.parse import parse_qs, urljoin, urlsplit
 
 import requests
 import urllib3
+from urllib3.util.retry import Retry
+from backends.webservice import WebServiceBackend, redact_token
 from configuration.config import Config
 from bs4 import BeautifulSoup
-from jinja2 import Environment, FileSystemLoader
 from requests.adapters import HTTPAdapter
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
-from selenium.webdriver.support import expected_conditions
-from selenium.webdriver.support.wait import WebDriverWait
 
-from ui.colors import welcome
+from monitoring.metrics import HttpStats, Metrics, Profiler, endpoint
+from network.rate_limiter import AdaptiveLimiter, HostLimiter, RateLimiter, retry_after_seconds
+from network.session_cache import SessionCache
+from parsing.pages import (COURSE_LIST, COURSE_PAGE, NESTED_PAGE, canonical_url, page_course, parse_page,
+                           section_links)
+from storage.blobs import BlobStore, link_or_copy, pluginfile_key
+from storage.manifest import Manifest, ManifestEntry
+from storage.page_cache import PAGE_CACHE_NAME, CachedPage, PageCache
+from storage.verify import VerifyReport, verify_archive
+from storage.parts import (PART_EXT, get_request_headers, get_resumable_part, hash_file, is_resumed, promote,
+                           remove_part, write_part_info)
+from ui.colors import Progress, welcome
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 logger = logging.getLogger("moodle_scraper")
-# save logs to file
-logging.basicConfig(filename='moodle_scraper.log', level=logging.INFO)
-# create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-# create formatter
-formatter = logging.Formatter(
-    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-# add formatter to ch
-ch.setFormatter(formatter)
-# add ch to logger
-logger.addHandler(ch)
 
 HTML_EXT = ".html"
 HTML_PARSER = "html.parser"
+# Only logged-in users get the log out link (with their session key) of the user menu: a guest
+# session also has a MoodleSession cookie and is not redirected to the login page
+LOGGED_IN_MARKER = re.compile(r"login/logout\.php\?sesskey=")
+
+CONFIG_FILE = "scraper.json"
+# Optional settings of scraper.json and their default values
+DEFAULT_CONFIG: Dict = {
+    # Include/exclude rules of courses and files (default: excluded-courses.ini), see configuration/config.py
+    "filters": None,
+    # This will fix corner cases where the home page is not the login page (e.g. CAS)
+    "login_url": None,
+    # Write the parsed home page to courses.html, to debug the course list
+    "dump_html": False,
+    # Files with the same content are stored once and hard linked into each course directory
+    "deduplicate": True,
+    # Size of the chunks read from the socket while streaming a download
+    "chunk_size": 64 * 1024,
+    # Size of the write buffer of each file being downloaded
+    "write_buffer_size": 1024 * 1024,
+    # Number of files downloaded at the same time
+    "workers": 4,
+    # "adaptive" adjusts the downloads running at the same time on each host to the server (more while it
+    # answers fast, fewer on 429/503, Retry-After or rising latency), up to `downloads_per_host` (or
+    # `workers`); "fixed" always allows `downloads_per_host` (0: no limit)
+    "throttling": "adaptive",
+    "downloads_per_host": 0,
+    # Downloads started per second and per host (0 disables rate limiting), and how many can start at once
+    "requests_per_second": 0,
+    "burst": 1,
+    # "html" scrapes the course pages, "webservice" uses Moodle's REST API (with `token`, or one requested
+    # with the credentials from login/token.php)
+    "backend": "html",
+    "token": None,
+    # "auto": log in with plain HTTP requests and fall back to Selenium, "http" or "selenium" to force one of them
+    "login_mode": "auto",
+    # Cookies of the last login are reused until they expire (set to "" to always log in);
+    # by default, in a file named after the Moodle URL and the user
+    "session_cache": None,
+    "session_max_age": 6 * 3600,
+    # "threads" downloads with one blocking request per worker, "asyncio" with aiohttp on an event loop
+    # (`workers` connections in total, at most `connections_per_host` per host)
+    "engine": "threads",
+    "connections_per_host": 8,
+    # Number of course (and nested assignment) pages fetched at the same time
+    "crawl_workers": 4,
+    # "crawl" starts the downloads of each course as soon as its pages are crawled; "largest_first" (or
+    # "interleave": largest and smallest alternately) crawls every course first, then discovers the size of the
+    # new files with concurrent HEAD requests and queues all the downloads by size, so that a big file is not
+    # started last and does not stretch the end of the run
+    "schedule": "crawl",
+    # Bytes received, throughput and ETA of the downloads on one line of the terminal (not in log files)
+    "progress": True,
+    # Section pages (course/view.php?id=...&section=N) followed from each course page, at most this many
+    # links away from it (0: only the course page is read)
+    "section_depth": 2,
+    # Kept-alive connections per host (default: one per download and crawl worker), and retries of failed
+    # GET requests (connection errors, 429 and 5xx) with an exponential backoff, honouring Retry-After
+    "pool_size": None,
+    "retries": 3,
+    "backoff": 0.5,
+    # The JSON summary of a run (time per stage, throughput, requests, retries and latency per endpoint)
+    # is logged at the end of the run, and also written to this file when set
+    "metrics_file": None,
+    # cProfile dump of the run (all threads), e.g. "moodle_scraper.prof", read with `python -m pstats`
+    "profile_file": None,
+    # What was extracted from course, section and assignment pages is kept in this file (by default,
+    # .moodlescrap-pages.sqlite in the saving directory; "" disables it): pages fetched less than
+    # `page_cache_ttl` seconds ago are not requested again, older ones are revalidated with their ETag or
+    # Last-Modified when Moodle sends them; the least recently used pages are evicted beyond `page_cache_size` bytes
+    "page_cache": None,
+    "page_cache_ttl": 0,
+    "page_cache_size": 32 * 1024 * 1024,
+}
+
+
+def load_config(file: str = CONFIG_FILE) -> Dict:
+    with open(file, "r", encoding="utf-8") as read_file:
+        return json.load(read_file)
+
+
+class FeedbackRetry(Retry):
+    """
+    Retry reporting each 429 or 503 answer (with its Retry-After) as soon as it arrives, before waiting to retry
+    """
+    feedback: Optional[Callable] = None
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.feedback = self.feedback
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if self.feedback is not None and response is not None and _pool is not None \
+                and response.status in (429, 503):
+            default_port = 443 if _pool.scheme == "https" else 80
+            netloc = _pool.host if _pool.port in (None, default_port) else f"{_pool.host}:{_pool.port}"
+            self.feedback(f"{_pool.scheme}://{netloc}{url}", response.status, None,
+                          retry_after_seconds(response.headers.get("Retry-After")))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter recording the latency (time to the response headers) and retries of each request, per endpoint
+    """
 
-config = json.load(open('scraper.json'))
-USERNAME = config['user']
-PASSWORD = config['pwd']
-BASEURL = config['baseurl']
-DIRECTORY = config['directory']
-# This is optional and will fix corner cases where the home page is not the login page (e.g. CAS)
-LOGIN_URL = config.get('login_url', None)
+    def __init__(self, stats: HttpStats, feedback: Optional[Callable] = None, **kwargs):
+        self.stats: HttpStats = stats
+        # Called with the URL, status, latency, Retry-After and throttled retries of each response
+        self.feedback: Optional[Callable] = feedback
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        latency = time.perf_counter() - start
+        retries = getattr(response.raw, "retries", None)
+        history = retries.history if retries else ()
+        self.stats.record(request.url, latency, len(history))
+        if self.feedback is not None:
+            # The latency of a retried request includes the waits between its attempts, and the one of a HEAD
+            # request (size discovery) cannot be compared with the one of a download
+            self.feedback(request.url, response.status_code,
+                          None if history or request.method != "GET" else latency,
+                          retry_after_seconds(response.headers.get("Retry-After")))
+        return response
+
+    def connections(self) -> Tuple[int, int]:
+        """
+        Connections opened and requests sent by the pools of this adapter
+        """
+        opened, sent = 0, 0
+        for key in self.poolmanager.pools.keys():
+            pool = self.poolmanager.pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+        return opened, sent
 
 
 class Downloader:
-    def __init__(self, debugging=False):
-        self.username = USERNAME
-        self.password = PASSWORD
-        self.directory = DIRECTORY
-        self.moodle_url: str = BASEURL
+    def __init__(self, debugging=False, config: Optional[Dict] = None):
+        """
+        `config` holds the settings of scraper.json, which is read when it is not given
+        """
+        config = {**DEFAULT_CONFIG, **(load_config() if config is None else config)}
+        self.username = config['user']
+        self.password = config['pwd']
+        self.directory = config['directory']
+        self.moodle_url: str = config['baseurl']
         # None: use the default moodle login page; otherwise, use the specified login page (e.g. the specific CAS page)
-        self.login_url: str = LOGIN_URL
-        self.config: Config = Config()
-        self.threads_list: List[Thread] = []
+        self.login_url: str = config['login_url']
+        self.config: Config = Config(config['filters'])
+        self.config.get_config()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        # True when the download pool is shared with other downloaders (batch mode) and must be kept open
+        self.shared_executor: bool = False
+        self.futures: List[Future] = []
         self.session = None
+        # Home page fetched by the login, which lists the courses
+        self.home_page: Optional[str] = None
         self.courses: Dict[str, str] = {}
         self.files: Dict[str, Dict[str, str]] = {}
         self.paragraphs: Dict[str, List[str]] = {}
         self.pool_size: int = 0
         self.save_path: str = ""
         self.course_paths_list: List[str] = []
-        self.wait_time: int = 0
         # This will skip extension "quiz" or "assign" files
         self.skip_assignments: bool = True
         self.debugging = False
+        self.dump_html: bool = config['dump_html']
+        self.chunk_size: int = config['chunk_size']
+        self.write_buffer_size: int = config['write_buffer_size']
+        self.workers: int = config['workers']
+        self.rate_limiter: RateLimiter = RateLimiter(
+            config['requests_per_second'], config['burst'])
+        self.host_limiter: Union[HostLimiter, AdaptiveLimiter] = (
+            AdaptiveLimiter(config['downloads_per_host'] or self.workers) if config['throttling'] == "adaptive"
+            else HostLimiter(config['downloads_per_host']))
+        self.crawl_workers: int = config['crawl_workers']
+        self.schedule: str = config['schedule']
+        # Expected size of the files to download (None: unknown), from the size discovery
+        self.file_sizes: Dict[str, Optional[int]] = {}
+        self.progress: Optional[Progress] = Progress() if config['progress'] and sys.stderr.isatty() else None
+        self.section_depth: int = config['section_depth']
+        self.engine_name: str = config['engine']
+        self.connections_per_host: int = config['connections_per_host']
+        self.engine = None
+        self.pool_size_per_host: int = config['pool_size'] or self.workers + self.crawl_workers
+        self.retries: int = config['retries']
+        self.backoff: float = config['backoff']
+        self.metrics: Metrics = Metrics()
+        self.metrics_file: Optional[str] = config['metrics_file']
+        self.page_cache_file: Optional[str] = config['page_cache']
+        self.page_cache_ttl: float = config['page_cache_ttl']
+        self.page_cache_size: int = config['page_cache_size']
+        self.page_cache: Optional[PageCache] = None
+        self.profile_file: Optional[str] = config['profile_file']
+        self.adapters: List[InstrumentedAdapter] = []
+        self.nested_executor: Optional[ThreadPoolExecutor] = None
+        # Nested pages already requested during a crawl, each one is fetched once whatever links to it
+        self.nested_pages: Dict[str, Future] = {}
+        self._nested_lock = threading.Lock()
+        self.manifest: Optional[Manifest] = None
+        self.deduplicate: bool = config['deduplicate']
+        self.blobs: Optional[BlobStore] = None
+        # Moodle file -> (download, destination, link) of its first download in this run
+        self.downloads_by_key: Dict[str, Tuple[Future, str, str]] = {}
+        session_cache = config['session_cache']
+        if session_cache is None:
+            account = hashlib.sha1(f"{self.moodle_url}|{self.username}".encode("utf-8")).hexdigest()[:12]
+            session_cache = f".moodlescrap-session-{account}.json"
+        self.session_cache: SessionCache = SessionCache(
+            session_cache, config['session_max_age'])
+        self.login_mode: str = config['login_mode']
+        self.backend: str = config['backend']
+        self.token: Optional[str] = config['token']
+        self.webservice: Optional[WebServiceBackend] = None
+        self._stats_lock = threading.Lock()
+        self.downloaded_files: int = 0
+        self.downloaded_bytes: int = 0
+        self.page_cache_stats: Dict[str, int] = {"hits": 0, "revalidated": 0, "misses": 0}
+
+    def run(self, show_welcome=True):
+        if show_welcome:
+            welcome()
+        with Profiler(self.profile_file):
+            self.login()
+            # OK but TODO: get_courses_all to go the ALL courses page to scrap everything!
+            with self.metrics.stage("course_list"):
+                self.courses = self.get_courses()
+            self.create_saving_directory()
+            if self.schedule == "crawl":
+                # Downloads of a course start as soon as its page is parsed, while the next courses are still crawled
+                self.get_files(on_course=self.save_course_files)
+            else:
+                self.get_files()
+                self.discover_sizes()
+                self.save_files()
+            self.save_text()
+            self.clean_up_threads()
+        self.log_metrics()
+
+    def login(self) -> None:
+        """
+        Open the session of the account: with the cached cookies, the HTTP login or Selenium, or a web
+        service token with the webservice backend
+        """
+        with self.metrics.stage("login"):
+            if self.backend == "webservice":
+                self.session = self.new_session()
+                self.webservice = self.get_webservice()
+            else:
+                self.session = self.get_session()
 
-    def run(self):
-        welcome()
-        self.session = self.get_session()
-        # OK but TODO: get_courses_all to go the ALL courses page to scrap everything!
-        self.courses = self.get_courses()
-        self.get_files()
-        # BUG Some courses have clickable link sections (e.g. Responsible Leadership); therefore, we need to get the sections first ; make a recursive click to update the page source code ...
-        # --> so TODO: deal with that recursively! modify the get_courses to recursively check the section's links (if any; i.e. those with a href and a url containing "/courses/" but not the one currently checked (avoiding infinite loops))
-        self.session.mount(
-            "https://",
-            HTTPAdapter(pool_connections=self.pool_size,
-                        pool_maxsize=self.pool_size),
+    def new_session(self) -> requests.Session:
+        """
+        A session whose connection pools are sized for the crawl and download workers, with retries
+        and instrumentation (pages are gzip-compressed when the server supports it)
+        """
+        session_requests = requests.session()
+        retry = FeedbackRetry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False,
         )
-        self.create_saving_directory()
-        self.save_text()
-        self.save_files()
-        self.clean_up_threads()
+        retry.feedback = self._throttle_feedback
+        adapter = InstrumentedAdapter(
+            self.metrics.http,
+            feedback=retry.feedback,
+            pool_connections=max(1, self.pool_size_per_host),
+            pool_maxsize=max(1, self.pool_size_per_host),
+            max_retries=retry,
+        )
+        self.adapters.append(adapter)
+        session_requests.mount("https://", adapter)
+        session_requests.mount("http://", adapter)
+        session_requests.headers["Accept-Encoding"] = "gzip, deflate"
+        session_requests.headers["Connection"] = "keep-alive"
+        return session_requests
+
+    def _throttle_feedback(self, url: str, status: int, latency: Optional[float],
+                           retry_after: Optional[float] = None) -> None:
+        """
+        Only the downloads go through the host limiter, so only their responses adapt it: pages are slower
+        to generate than files are to send and would be taken for congestion. The limiter is looked up on
+        each response since it can be replaced after the session is created (batch mode)
+        """
+        if endpoint(url) == "/pluginfile.php":
+            self.host_limiter.record(url, status, latency, retry_after)
+
+    def get_metrics(self) -> Dict:
+        """
+        Summary of the run so far: time per stage, download throughput, and HTTP requests, retries,
+        latencies (overall and per endpoint) and connections
+        """
+        summary: Dict = self.metrics.summary(self.downloaded_files, self.downloaded_bytes)
+        opened, sent = 0, 0
+        for adapter in self.adapters:
+            adapter_opened, adapter_sent = adapter.connections()
+            opened += adapter_opened
+            sent += adapter_sent
+        summary["http"]["connections"] = opened
+        summary["http"]["reuse_ratio"] = round(1 - opened / sent if sent else 0.0, 3)
+        summary["page_cache"] = dict(self.page_cache_stats)
+        return summary
+
+    def log_metrics(self) -> None:
+        summary: Dict = self.get_metrics()
+        http: Dict = summary["http"]
+        logger.info(
+            "HTTP: %s requests (%s retries) on %s connections, reuse ratio %.0f%%, "
+            "latency p50 %.0f ms, p95 %.0f ms",
+            http["requests"], http["retries"], http["connections"], http["reuse_ratio"] * 100,
+            http["p50_ms"], http["p95_ms"],
+        )
+        logger.info("Metrics: %s", json.dumps(summary))
+        if self.metrics_file:
+            with open(self.metrics_file, "w", encoding="utf-8") as write_file:
+                json.dump(summary, write_file, indent=2)
 
     def get_webdriver(self):
+        # Selenium is slow to import, and only needed when the HTTP login fails
+        from selenium import webdriver
+        from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+
         attempts_left: int = 5
         chrome_options = webdriver.ChromeOptions()
         caps = DesiredCapabilities().CHROME
@@ -131,11 +407,37 @@ class Downloader:
                 "environment variables or passed as arguments on the "
                 "command line "
             )
-
-        driver = self.get_webdriver()
         assert self.moodle_url is not None and self.moodle_url.endswith(
             "/"), "Moodle URL must be specified and end with a /"
 
+        start = time.perf_counter()
+        cached_session = self._get_cached_session()
+        if cached_session is not None:
+            logger.info("Logged in with the cached session in %.2f seconds",
+                        time.perf_counter() - start)
+            return cached_session
+
+        if self.login_mode != "selenium":
+            http_session = self._get_http_session()
+            if http_session is not None:
+                self.session_cache.save([
+                    {"name": c.name, "value": c.value, "expiry": c.expires}
+                    for c in http_session.cookies
+                ])
+                logger.info("Logged in without a browser in %.2f seconds",
+                            time.perf_counter() - start)
+                return http_session
+            if self.login_mode == "http":
+                logger.info(
+                    "Could not log in to Moodle. Please check your username and "
+                    "password"
+                )
+                sys.exit(1)
+            logger.info("Falling back to the Selenium login")
+
+        from selenium.webdriver.common.by import By
+        driver = self.get_webdriver()
+
         if self.login_url:
             driver.get(self.login_url)
         else:
@@ -172,7 +474,7 @@ class Downloader:
 
         # This is a hack to get around the fact that the MoodleSession cookie
         # is not being set properly (TODO: delete this?)
-        session_requests = requests.session()
+        session_requests = self.new_session()
         cookies = driver.get_cookies()
         for cookie in cookies:
             session_requests.cookies.set(cookie["name"], cookie["value"])
@@ -190,17 +492,137 @@ class Downloader:
             driver.close()
             sys.exit(1)
 
+        self.session_cache.save(cookies)
         driver.close()
+        logger.info("Logged in with Selenium in %.2f seconds",
+                    time.perf_counter() - start)
+
+        return session_requests
+
+    def _get_http_session(self) -> Optional[requests.Session]:
+        """
+        Log in with plain requests: fill the CAS form (with its hidden lt/execution tokens) or the
+        Moodle login form (with its logintoken), post it and follow the redirects back to Moodle
+        """
+        session_requests = self.new_session()
+        try:
+            result = session_requests.get(
+                self.login_url or self.moodle_url, verify=False)
+            soup = BeautifulSoup(result.text, HTML_PARSER)
+            password_field = soup.find("input", {"type": "password"})
+            if password_field is None and not self.login_url:
+                # The home page is not the login page
+                result = session_requests.get(
+                    f"{self.moodle_url}login/index.php", verify=False)
+                soup = BeautifulSoup(result.text, HTML_PARSER)
+                password_field = soup.find("input", {"type": "password"})
+
+            form = password_field.find_parent("form") if password_field else None
+            if form is None:
+                logger.info("Could not find a login form on %s", result.url)
+                return None
+
+            data: Dict[str, str] = {}
+            for field in form.find_all("input"):
+                if field.get("name") and field.get("type") not in ("submit", "button", "checkbox"):
+                    data[field["name"]] = field.get("value", "")
+            data[password_field["name"]] = self.password
+            username_field = form.find("input", {"id": "username"}) or form.find(
+                "input", {"name": "username"})
+            data[username_field["name"] if username_field else "username"] = self.username
+            button = form.find(["button", "input"], {"name": "submit"})
+            if button is not None:
+                data["submit"] = button.get("value", "")
+
+            action = urljoin(result.url, form.get("action") or result.url)
+            result = session_requests.post(
+                action, data=data, headers=dict(referer=result.url), verify=False)
+            result = session_requests.get(
+                self.moodle_url, headers=dict(referer=self.moodle_url), verify=False)
+        except requests.RequestException as e:
+            logger.info("HTTP login failed | %s", e)
+            return None
+
+        logged_in = any(c.name.startswith("MoodleSession") for c in session_requests.cookies)
+        if not logged_in or self._is_login_page(result.url) or not result.url.startswith(self.moodle_url) \
+                or not self._is_logged_in(result.text):
+            logger.info("HTTP login was not accepted (ended on %s)", result.url)
+            return None
+        self.home_page = result.text
+        return session_requests
+
+    def _get_cached_session(self) -> Optional[requests.Session]:
+        """
+        Rebuild a session from the cached cookies, if one cheap request shows they are still logged in
+        """
+        cookies = self.session_cache.load()
+        if not cookies:
+            return None
 
+        session_requests = self.new_session()
+        for cookie in cookies:
+            session_requests.cookies.set(cookie["name"], cookie["value"])
+        try:
+            result = session_requests.get(
+                self.moodle_url, headers=dict(referer=self.moodle_url), verify=False)
+        except requests.RequestException as e:
+            logger.info("Could not check the cached session | %s", e)
+            return None
+
+        if self._is_login_page(result.url) or not self._is_logged_in(result.text):
+            logger.info("Cached session is no longer logged in")
+            self.session_cache.clear()
+            return None
+        self.home_page = result.text
         return session_requests
 
+    def _is_login_page(self, url) -> bool:
+        return url.startswith(f"{self.moodle_url}login/index.php") or bool(
+            self.login_url and url.startswith(self.login_url))
+
+    def _is_logged_in(self, page: str) -> bool:
+        return LOGGED_IN_MARKER.search(page) is not None
+
+    def get_webservice(self) -> WebServiceBackend:
+        webservice = WebServiceBackend(self.session, self.moodle_url, self.token)
+        if not self.token:
+            if not (self.username and self.password):
+                raise ValueError(
+                    "A web service token, or a username and password, must be specified")
+            webservice.login(self.username, self.password)
+        return webservice
+
     def get_courses(self) -> Dict[str, str]:
+        if self.webservice is not None:
+            courses_dict: Dict[str, str] = self.webservice.get_courses()
+            for course_name in courses_dict:
+                logger.info("Course: %s", course_name)
+        else:
+            courses_dict = self._scrape_courses()
+
+        courses_dict = self._check_exclusions(courses_dict)
+
+        if not courses_dict:
+            logger.error("Could not find any courses, exiting...")
+            sys.exit(0)
+        else:
+            logger.info("Found %s courses successfully", len(courses_dict))
+
+        return courses_dict
+
+    def _scrape_courses(self) -> Dict[str, str]:
         courses_dict: Dict[str, str] = {}
         url: str = f"{self.moodle_url}"
-        result = self.session.get(url, headers=dict(referer=url), verify=False)
-        soup = BeautifulSoup(result.text, HTML_PARSER)
-        with open("courses.html", "w", encoding="utf-8") as f:
-            f.write(soup.prettify())
+        # The login already fetched the home page
+        text: Optional[str] = self.home_page
+        self.home_page = None
+        if text is None:
+            text = self.session.get(url, headers=dict(referer=url), verify=False).text
+        if self.dump_html:
+            with open("courses.html", "w", encoding="utf-8") as f:
+                f.write(BeautifulSoup(text, HTML_PARSER).prettify())
+        with self.metrics.stage("parse"):
+            soup = parse_page(text, COURSE_LIST)
         course_sidebar = soup.select("#nav-drawer > nav > ul")
 
         for header in course_sidebar[0].find_all("li"):
@@ -211,59 +633,166 @@ class Downloader:
                 courses_dict[course_name] = course_link
                 logger.info("Course: %s", course_name)
 
-        self._check_exclusions(courses_dict)
-
-        if not courses_dict:
-            logger.error("Could not find any courses, exiting...")
-            sys.exit(0)
-        else:
-            logger.info("Found %s courses successfully", len(courses_dict))
-
         return courses_dict
 
-    def _check_exclusions(self, courses_dict):
-        if self.config.excluded_courses:
-            for course in courses_dict.copy():
-                for exclusion in self.config.excluded_courses:
-                    if exclusion in course.lower():
-                        logger.info("Excluding course: %s", exclusion)
-                        courses_dict.pop(course)
-
-    def get_files(self) -> None:
+    def _check_exclusions(self, courses_dict) -> Dict[str, str]:
+        """
+        Courses allowed by the course rules, which are matched once per course before anything is crawled
+        """
+        allowed: Dict[str, str] = {
+            course: link for course, link in courses_dict.items() if self.config.course_allowed(course)}
+        for course in courses_dict:
+            if course not in allowed:
+                logger.info("Excluding course: %s", course)
+        return allowed
+
+    def _check_file_exclusions(self, files_dict) -> Dict[str, str]:
+        """
+        Files of a crawled course allowed by the file rules (names, extensions), before any of them is downloaded
+        """
+        if not self.config.has_file_rules:
+            return files_dict
+        allowed: Dict[str, str] = {
+            name: link for name, link in files_dict.items() if self.config.file_allowed(name)}
+        if len(allowed) != len(files_dict):
+            logger.info("Excluded %s of %s files", len(files_dict) - len(allowed), len(files_dict))
+        return allowed
+
+    def get_files(self, on_course: Optional[Callable[[str, Dict[str, str]], None]] = None) -> None:
+        """
+        Crawl the course pages concurrently; results (and `on_course` calls) keep the order of self.courses
+        """
         num_of_files: int = 0
         files_per_course: Dict[str, Dict[str, str]] = {}
         text_per_course: Dict[str, List[str]] = {}
         logger.info("Going through each course Moodle page")
-        for course, link in self.courses.items():
-            logger.info("Course: %s, link: %s", course, link)
-            course_page = self.session.get(
-                link, headers=dict(referer=link), verify=False
-            )
-            soup = BeautifulSoup(course_page.text, HTML_PARSER)
-
-            text_list: List[str] = []
-            for text in soup.find_all("div", {"class": "no-overflow"}):
-                for text_block in text.find_all("p"):
-                    text_list.append(text_block.getText())
-
-            sanitized_course = get_valid_name(course)
-
-            if text_list:
-                text_list = [text.replace("\xa0", " ") for text in text_list]
-                text_list = list(dict.fromkeys(text_list))
-                text_per_course[sanitized_course] = text_list
-
-            files_dict: Dict[str, str] = self._get_files_dict(soup)
-            num_of_files += len(files_dict)
-            files_per_course[sanitized_course] = files_dict
+        with ThreadPoolExecutor(max_workers=self.crawl_workers, thread_name_prefix="crawl") as executor, \
+                ThreadPoolExecutor(max_workers=self.crawl_workers, thread_name_prefix="nested") as nested_executor:
+            self.nested_executor = nested_executor
+            self.nested_pages = {}
+            futures = [
+                executor.submit(self._crawl_course, course, link)
+                for course, link in self.courses.items()
+            ]
+            for future in futures:
+                sanitized_course, text_list, files_dict = future.result()
+                if text_list:
+                    text_per_course[sanitized_course] = text_list
+                num_of_files += len(files_dict)
+                files_per_course[sanitized_course] = files_dict
+                if on_course is not None:
+                    on_course(sanitized_course, files_dict)
+            self.nested_executor = None
+            self.nested_pages = {}
 
         logger.debug("Size of pool: %s", num_of_files)
         self.files = files_per_course
         self.paragraphs = text_per_course
         self.pool_size = num_of_files
 
-    def _get_files_dict(self, soup) -> Dict[str, str]:
+    def _crawl_course(self, course, link) -> Tuple[str, List[str], Dict[str, str]]:
+        logger.info("Course: %s, link: %s", course, link)
+        with self.metrics.stage("course_crawl"):
+            if self.webservice is not None:
+                text_list, files_dict = self.webservice.get_course_files(course)
+                for file_name, file_link in files_dict.items():
+                    self._log_file(file_name, file_link)
+            else:
+                text_list, files_dict = self._crawl_sections(link)
+        return get_valid_name(course), text_list, self._check_file_exclusions(files_dict)
+
+    def _crawl_sections(self, link) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Breadth-first walk from the course page over its section pages, up to `section_depth` links away:
+        every unique page is fetched once (pages of a level in parallel) and merged in the order it was found
+        """
+        text_list: List[str] = []
         files_dict: Dict[str, str] = {}
+        visited: Set[str] = {canonical_url(link)}
+        course_id: Optional[str] = (parse_qs(urlsplit(link).query).get("id") or [None])[0]
+        level: List[Future] = [self._submit_nested(self._get_course_page, link, link)]
+        depth: int = 0
+        while level:
+            next_level: List[Future] = []
+            for future in level:
+                page: Dict = future.result()
+                if depth and page.get("course") not in (None, course_id):
+                    # A section of another course, linked from this one: its files belong to that course
+                    logger.info("Skipping a section of course %s linked from %s", page["course"], link)
+                    continue
+                if depth < self.section_depth:
+                    for section_link in page["sections"]:
+                        if section_link not in visited:
+                            visited.add(section_link)
+                            logger.info("Section: %s", section_link)
+                            next_level.append(self._submit_nested(self._get_course_page, section_link, link))
+                text_list += page["paragraphs"]
+                files_dict.update(self._resolve_file_entries(page["entries"]))
+            level = next_level
+            depth += 1
+
+        logger.debug("Crawled %s pages of %s", len(visited), link)
+        return list(dict.fromkeys(text_list)), files_dict
+
+    def _get_course_page(self, link, course_link) -> Dict:
+        """
+        Paragraphs, file entries and section links of a course (or section) page
+        """
+        return self._get_cached_page(link, COURSE_PAGE, lambda soup, text: {
+            "paragraphs": self._get_paragraphs(soup),
+            "entries": self._get_file_entries(soup),
+            "sections": section_links(soup, course_link),
+            "course": page_course(text),
+        })
+
+    def _get_cached_page(self, link, only, extract: Callable[[BeautifulSoup, str], Dict]) -> Dict:
+        """
+        What `extract` reads from a page (parsed, and as text); with the page cache, fresh pages are not requested and the others
+        are revalidated with their validators (a 304 Not Modified answer skips the parse as well)
+        """
+        cached: Optional[CachedPage] = self.page_cache.get(link) if self.page_cache else None
+        if cached is not None and self.page_cache.is_fresh(cached):
+            self._count_page("hits")
+            return cached.result
+
+        headers: Dict[str, str] = dict(referer=link)
+        if cached is not None:
+            headers.update(cached.conditional_headers())
+        response = self.session.get(link, headers=headers, verify=False)
+        if cached is not None and response.status_code == 304:
+            self.page_cache.refresh(link)
+            self._count_page("revalidated")
+            return cached.result
+
+        with self.metrics.stage("parse"):
+            soup = parse_page(response.text, only)
+        result: Dict = extract(soup, response.text)
+        if self.page_cache is not None and response.ok and not self._is_login_page(response.url):
+            self.page_cache.put(
+                link, response.headers.get("ETag"), response.headers.get("Last-Modified"), result)
+            self._count_page("misses")
+        return result
+
+    def _count_page(self, outcome) -> None:
+        with self._stats_lock:
+            self.page_cache_stats[outcome] += 1
+
+    def _get_paragraphs(self, soup) -> List[str]:
+        text_list: List[str] = []
+        for text in soup.find_all("div", {"class": "no-overflow"}):
+            for text_block in text.find_all("p"):
+                text_list.append(text_block.getText())
+
+        if text_list:
+            text_list = [text.replace("\xa0", " ") for text in text_list]
+            text_list = list(dict.fromkeys(text_list))
+        return text_list
+
+    def _get_file_entries(self, soup) -> List[Tuple[str, str]]:
+        """
+        (file name, file link) of a page in page order, with ("", link) for a nested page to unfold
+        """
+        entries: List[Tuple[str, str]] = []
 
         for activity in soup.find_all("div", {"class": "activityinstance"}):
             file_type = activity.find("img")["src"]
@@ -281,24 +810,37 @@ class Downloader:
                 continue
 
             self._log_file(file_name, file_link)
-            files_dict[file_name] = file_link
+            entries.append((file_name, file_link))
 
             if HTML_EXT in extension:
-                nested_files_dict = self._get_nested_files(file_link)
-                files_dict = {**files_dict, **nested_files_dict}
+                entries.append(("", file_link))
 
         for file_in_sub_folder in soup.find_all("span", {"class": "fp-filename-icon"}):
             file_link = file_in_sub_folder.find("a").get("href")
             file_name = file_in_sub_folder.find(
                 "span", {"class": "fp-filename"}).text
             self._log_file(file_name, file_link)
-            files_dict[file_name] = file_link
+            entries.append((file_name, file_link))
+
+        return entries
 
+    def _resolve_file_entries(self, entries) -> Dict[str, str]:
+        """
+        Merge file entries in order, once every nested page they point to is fetched (in parallel)
+        """
+        pending: List[Tuple[str, object]] = [
+            (name, self._submit_nested_files(link) if not name else link) for name, link in entries
+        ]
+        files_dict: Dict[str, str] = {}
+        for name, value in pending:
+            if isinstance(value, Future):
+                files_dict.update(value.result())
+            else:
+                files_dict[name] = value
         return files_dict
 
     def _log_file(self, file_name, file_link) -> None:
-        logger.info("File name: %s", file_name)
-        logger.info("File link: %s", file_link)
+        logger.debug("File: %s, link: %s", file_name, file_link)
 
     def _get_extension(self, file_type) -> str:
         extension = ""
@@ -319,13 +861,30 @@ class Downloader:
             extension = HTML_EXT
         return extension
 
+    def _submit_nested(self, function, *args) -> Future:
+        """
+        Run `function` in the nested pool during a crawl, right away otherwise
+        """
+        if self.nested_executor is not None:
+            return self.nested_executor.submit(function, *args)
+        future: Future = Future()
+        future.set_result(function(*args))
+        return future
+
+    def _submit_nested_files(self, link) -> Future:
+        with self._nested_lock:
+            if link not in self.nested_pages:
+                self.nested_pages[link] = self._submit_nested(self._get_nested_files, link)
+            return self.nested_pages[link]
+
     def _get_nested_files(self, link) -> Dict[str, str]:
         """
         Recursive step to unfold nested files
         """
-        result = self.session.get(
-            link, headers=dict(referer=link), verify=False)
-        soup = BeautifulSoup(result.text, HTML_PARSER)
+        with self.metrics.stage("nested_crawl"):
+            return self._get_cached_page(link, NESTED_PAGE, lambda soup, text: self._get_submissions(soup))
+
+    def _get_submissions(self, soup) -> Dict[str, str]:
         files_dict = {}
         for nested_file in soup.find_all("div", {"class": "fileuploadsubmission"}):
             a_tag = nested_file.find("a", {"target": "_blank"})
@@ -336,15 +895,16 @@ class Downloader:
 
         return files_dict
 
-    def create_saving_directory(self) -> None:
-        this_path: str = self.directory
-
+    def get_saving_directory(self) -> str:
         if not self.directory:
             logger.debug(
                 "Saving directory not specified, using current working directory"
             )
-            this_path = f"{os.getcwd()}/courses"
-            logger.debug(this_path)
+            return f"{os.getcwd()}/courses"
+        return self.directory
+
+    def create_saving_directory(self) -> None:
+        this_path: str = self.get_saving_directory()
 
         course_paths: List[str] = []
 
@@ -361,27 +921,42 @@ class Downloader:
         else:
             logger.info("%s exists and will be used to save files", this_path)
 
+        self.save_path = this_path
+        self.course_paths_list = course_paths
+        if self.manifest is None:
+            self.manifest = Manifest(this_path)
+            logger.info("%s files recorded in the manifest", len(self.manifest))
+        if self.deduplicate and self.blobs is None:
+            self.blobs = BlobStore(this_path)
+        if self.page_cache is None and self.page_cache_file != "":
+            self.page_cache = PageCache(
+                self.page_cache_file or os.path.join(this_path, PAGE_CACHE_NAME),
+                self.page_cache_ttl, self.page_cache_size)
+            logger.info("%s pages in the page cache", len(self.page_cache))
+
         for course in self.files:
-            course_path = f"{this_path}/{course}"
-            course_paths.append(course_path)
-            if not os.path.exists(course_path):
-                try:
-                    pathlib.Path(course_path).mkdir(
-                        parents=True, exist_ok=True)
-                except OSError as e:
-                    logger.error(str(e))
-                    logger.error(
-                        "Creation of the directory %s failed", course_path)
-                    raise OSError
-                else:
-                    logger.info(
-                        "Successfully created the directory %s", course_path)
+            self._create_course_directory(course)
+
+    def _create_course_directory(self, course) -> str:
+        course_path = f"{self.save_path}/{course}"
+        if course_path not in self.course_paths_list:
+            self.course_paths_list.append(course_path)
+        if not os.path.exists(course_path):
+            try:
+                pathlib.Path(course_path).mkdir(
+                    parents=True, exist_ok=True)
+            except OSError as e:
+                logger.error(str(e))
+                logger.error(
+                    "Creation of the directory %s failed", course_path)
+                raise OSError
             else:
                 logger.info(
-                    "%s exists and will be used to save files", course_path)
-
-        self.save_path = this_path
-        self.course_paths_list = course_paths
+                    "Successfully created the directory %s", course_path)
+        else:
+            logger.info(
+                "%s exists and will be used to save files", course_path)
+        return course_path
 
     def save_text(self) -> None:
         for course, paragraph in self.paragraphs.items():
@@ -394,41 +969,187 @@ class Downloader:
                 write_file.writelines(paragraph_text)
             logger.info("Wrote info for %s successfully", course)
 
-    def save_files(self) -> None:
-        for course, links in self.files.items():
-            current_path: str = f"{self.save_path}/{course}"
+    def discover_sizes(self, files: Optional[Dict[str, Dict[str, str]]] = None) -> None:
+        """
+        Expected size of every file to download (of `files`, by default self.files): none for files recorded in
+        the manifest and still on disk (they are most likely not modified), the size listed by the webservice,
+        or else the Content-Length of a HEAD request (sent concurrently, by `crawl_workers` threads)
+        """
+        unknown: List[str] = []
+        for links in (self.files if files is None else files).values():
             for name, link in links.items():
-                name = name.replace("/", "")
-                filename, extension = os.path.splitext(name)
-                sanitized_name = get_valid_name(filename)
-                sanitized_name = f"{sanitized_name}{extension}"
-                if path.exists(f"{current_path}/{sanitized_name}"):
-                    logging.debug(
-                        "Already exists, skipping download: %s", sanitized_name)
+                if HTML_EXT in name or link in self.file_sizes:
+                    continue
+                entry: Optional[ManifestEntry] = self.manifest.get(link) if self.manifest else None
+                if entry is not None and os.path.exists(self.manifest.absolute_path(entry)):
+                    self.file_sizes[link] = 0
+                elif self.webservice is not None and link in self.webservice.file_sizes:
+                    self.file_sizes[link] = self.webservice.file_sizes[link]
                 else:
-                    t = Thread(
-                        target=self._parallel_save_files,
-                        kwargs={
-                            "current_path": current_path,
-                            "name": sanitized_name,
-                            "link": link,
-                        },
-                    )
-                    self.threads_list.append(t)
-                    t.start()
-                    msg: str = f"New file:\n{course}\n{sanitized_name}"
-                    logger.info(msg)
+                    self.file_sizes[link] = None
+                    unknown.append(link)
+
+        with self.metrics.stage("size_discovery"):
+            with ThreadPoolExecutor(max_workers=self.crawl_workers, thread_name_prefix="head") as executor:
+                for link, size in zip(unknown, executor.map(self._get_remote_size, unknown)):
+                    self.file_sizes[link] = size
+        known: List[int] = [size for size in self.file_sizes.values() if size is not None]
+        logger.info("%s files to check, %s bytes expected (%s HEAD requests, %s sizes unknown)",
+                    len(self.file_sizes), sum(known), len(unknown), len(self.file_sizes) - len(known))
+
+    def _get_remote_size(self, link) -> Optional[int]:
+        headers = self._get_remote_headers(link)
+        try:
+            return int(headers["Content-Length"]) if headers is not None else None
+        except (KeyError, ValueError):
+            return None
+
+    def _download_params(self, link) -> Dict[str, str]:
+        return self.webservice.download_params(link) if self.webservice is not None else {}
+
+    def _get_remote_headers(self, link) -> Optional[Mapping[str, str]]:
+        try:
+            # Like the downloads, so that Content-Length and ETag are those of the bytes saved on disk
+            response = self.session.head(
+                link, params=self._download_params(link), headers={"Accept-Encoding": "identity"},
+                verify=False, allow_redirects=True)
+            response.raise_for_status()
+            return response.headers
+        except requests.RequestException as e:
+            logger.debug("HEAD %s failed | %s", link, redact_token(str(e)))
+            return None
+
+    def get_schedule(self) -> List[Tuple[str, str, str]]:
+        """
+        (course, name, link) of every file, in the order of the downloads: by expected size, largest first
+        (files of unknown size last), or largest and smallest alternately with the "interleave" schedule
+        """
+        files: List[Tuple[str, str, str]] = [
+            (course, name, link) for course, links in self.files.items() for name, link in links.items()]
+        files.sort(key=lambda file: self.file_sizes.get(file[2]) or 0, reverse=True)
+        if self.schedule != "interleave":
+            return files
+        interleaved: List[Tuple[str, str, str]] = []
+        first, last = 0, len(files) - 1
+        while first <= last:
+            interleaved.append(files[first])
+            if first != last:
+                interleaved.append(files[last])
+            first, last = first + 1, last - 1
+        return interleaved
+
+    def save_files(self) -> None:
+        if self.schedule == "crawl":
+            for course, links in self.files.items():
+                self.save_course_files(course, links)
+            return
+        course_paths: Dict[str, str] = {course: self._create_course_directory(course) for course in self.files}
+        for course, name, link in self.get_schedule():
+            self._save_file(course, course_paths[course], name, link)
+
+    def save_course_files(self, course, links) -> None:
+        """
+        Queue the downloads of one course (its directory is created if needed)
+        """
+        current_path: str = self._create_course_directory(course)
+        if self.config.has_size_limits and self.schedule == "crawl":
+            self.discover_sizes({course: links})
+        for name, link in links.items():
+            self._save_file(course, current_path, name, link)
+
+    def _save_file(self, course, current_path, name, link) -> None:
+        """
+        Queue the download of one file
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="download")
+        if self.config.has_size_limits and HTML_EXT not in name:
+            size: Optional[int] = self._file_size(link)
+            if not self.config.size_allowed(size):
+                logger.info("Skipping %s (%s bytes, outside the size limits)", name, size)
+                return
+        name = name.replace("/", "")
+        filename, extension = os.path.splitext(name)
+        sanitized_name = get_valid_name(filename)
+        sanitized_name = f"{sanitized_name}{extension}"
+        exists: bool = path.exists(f"{current_path}/{sanitized_name}")
+        if exists and HTML_EXT in sanitized_name:
+            logging.debug(
+                "Already exists, skipping download: %s", sanitized_name)
+            return
+        destination: str = f"{current_path}/{sanitized_name}"
+        key: Optional[str] = None
+        if self.deduplicate and HTML_EXT not in sanitized_name:
+            key = pluginfile_key(link)
+            if key in self.downloads_by_key:
+                first_future, first_destination, first_link = self.downloads_by_key[key]
+                if first_destination != destination:
+                    logger.info("Same file as %s: %s", first_destination, destination)
+                    self.futures.append(self.executor.submit(
+                        self._save_duplicate, first_future, first_destination, first_link, link, destination))
+                return
+
+        if self.progress is not None and HTML_EXT not in sanitized_name:
+            self.progress.expect(link, self._expected_size(link))
+        # Existing files are still checked for updates with a conditional request
+        if self.engine_name == "asyncio" and HTML_EXT not in sanitized_name:
+            future = self._submit_async(link, destination)
+        else:
+            future = self.executor.submit(
+                self._parallel_save_files,
+                current_path=current_path,
+                name=sanitized_name,
+                link=link,
+            )
+        self.futures.append(future)
+        if key is not None:
+            self.downloads_by_key[key] = (future, destination, link)
+        if exists:
+            logger.debug("Checking for updates: %s", sanitized_name)
+        else:
+            msg: str = f"New file:\n{course}\n{sanitized_name}"
+            logger.info(msg)
+
+    def _file_size(self, link) -> Optional[int]:
+        entry: Optional[ManifestEntry] = self.manifest.get(link) if self.manifest else None
+        if entry is not None:
+            return entry.size
+        return self._expected_size(link)
+
+    def _expected_size(self, link) -> Optional[int]:
+        if link in self.file_sizes:
+            return self.file_sizes[link]
+        if self.webservice is not None:
+            return self.webservice.file_sizes.get(link)
+        return None
+
+    def _submit_async(self, link, destination) -> Future:
+        if self.engine is None:
+            # aiohttp is only needed (and imported) by the asyncio engine
+            from network.async_engine import AsyncDownloadEngine
+            self.engine = AsyncDownloadEngine(
+                self.session.cookies.get_dict(),
+                self.rate_limiter,
+                connections=self.workers,
+                connections_per_host=self.connections_per_host,
+                chunk_size=self.chunk_size,
+                write_buffer_size=self.write_buffer_size,
+                metrics=self.metrics,
+                on_progress=self.progress.advance if self.progress is not None else None,
+            )
+        entry, headers = self._prepare_sync(link, destination)
+        return self.engine.submit(
+            link, destination, headers, self._download_params(link), on_done=partial(self._finish_sync, link, destination, entry),
+            on_failed=partial(self._fail_sync, link, destination))
 
     def _parallel_save_files(self, current_path=None, name=None, link=None) -> None:
         params_are_valid: bool = current_path and name and link
 
         if params_are_valid:
-            sleep_time = self._get_next_wait_time()
-            logger.info("Waiting %s seconds before downloading: %s",
-                        sleep_time, name)
-            sleep(sleep_time)
             try:
                 if HTML_EXT in name:
+                    from jinja2 import Environment, FileSystemLoader
                     env = Environment(loader=FileSystemLoader("assets"))
                     template = env.get_template("link_template.html")
                     output = template.render(url_name=name, url=link)
@@ -436,30 +1157,371 @@ class Downloader:
                     with open(f"{current_path}/{name}", "w") as write_file:
                         write_file.write(output)
                 else:
-                    request = self.session.get(
-                        link, headers=dict(referer=link), verify=False
-                    )
-                    with open(f"{current_path}/{name}", "wb") as write_file:
-                        write_file.write(request.content)
+                    self._sync_file(link, f"{current_path}/{name}")
             except Exception as e:
-                logger.error("File with same name is open | %s", str(e))
-                # FIXME: log the full error and the line where this happens, especially the course name, course link, to
-                # self-verify it ; happens that some files are open and cannot be downloaded (link_template.html simultaneously opened)... maybe a try catch block?
+                self._fail_sync(link, f"{current_path}/{name}", e)
         else:
             logger.error("Some parameters were missing for parallel downloads")
 
-    def clean_up_threads(self) -> None:
-        for thread in self.threads_list:
-            logger.debug("Joining downloading threads: %s", thread.getName())
-            thread.join()
+    def _sync_file(self, link, destination) -> None:
+        """
+        Download a file unless the manifest (or the local copy) shows it is unchanged on Moodle
+        """
+        entry, headers = self._prepare_sync(link, destination)
+        with ExitStack() as slot:
+            # The wait for a free slot on the host is throttling too
+            with self.metrics.stage("throttle"):
+                slot.enter_context(self.host_limiter.slot(link))
+                self.rate_limiter.acquire(link)
+            with self.metrics.stage("download"):
+                result: Optional[ManifestEntry] = self._stream_to_file(
+                    link, destination, headers)
+        self._finish_sync(link, destination, entry, result)
+
+    def _prepare_sync(self, link, destination) -> Tuple[Optional[ManifestEntry], Dict[str, str]]:
+        """
+        Manifest entry of a file (moving it if it was renamed on Moodle) and the headers of its conditional request
+        """
+        entry: Optional[ManifestEntry] = None
+        if self.manifest is not None:
+            entry = self.manifest.get(link, self.manifest.relative_path(destination)) or self.manifest.get(link)
+        headers: Dict[str, str] = {}
+
+        if entry is not None:
+            previous_path = self.manifest.absolute_path(entry)
+            # A copy in another directory is the same file listed in another course, not a renamed one
+            if previous_path != os.path.abspath(destination) and os.path.exists(previous_path) \
+                    and not os.path.exists(destination) \
+                    and os.path.dirname(previous_path) == os.path.dirname(os.path.abspath(destination)):
+                logger.info("Renamed on Moodle, moving %s to %s",
+                            previous_path, destination)
+                os.replace(previous_path, destination)
+                self.manifest.remove(entry)
+
+        if os.path.exists(destination) and (entry is None or os.path.getsize(destination) == entry.size):
+            # Files downloaded before the manifest existed are checked against their modification time
+            headers = (entry.conditional_headers() if entry else {}) or {
+                "If-Modified-Since": formatdate(os.path.getmtime(destination), usegmt=True)
+            }
+        return entry, headers
+
+    def _finish_sync(self, link, destination, entry, result) -> None:
+        """
+        Record a downloaded (or not modified, when result is None) file in the manifest and the blob store
+        """
+        if self.progress is not None:
+            self.progress.done(link, result.size if result is not None else 0)
+        if result is not None:
+            with self._stats_lock:
+                self.downloaded_files += 1
+                self.downloaded_bytes += result.size if result.received is None else result.received
+        else:
+            logger.debug("Not modified, skipping download: %s", destination)
+            if entry is None:
+                result = ManifestEntry(
+                    link, destination, os.path.getsize(destination))
+            else:
+                result = entry
+        if self.manifest is not None:
+            result.path = self.manifest.relative_path(destination)
+            self.manifest.record(result)
+        if self.blobs is not None and result.sha256:
+            self.blobs.store(destination, result.sha256)
+            if entry is not None and entry.sha256 and entry.sha256 != result.sha256:
+                # The previous version was replaced: its blob is unused unless another file has the same content
+                self.blobs.release(entry.sha256)
+
+    def _fail_sync(self, link, destination, error: Exception) -> None:
+        """
+        A download (or the page of a link) failed: it is logged, and no longer expected by the progress line
+        """
+        logger.error("Could not save %s to %s | %s: %s", link, destination, type(error).__name__,
+                     redact_token(str(error)))
+        if self.progress is not None:
+            self.progress.done(link, 0)
+
+    def _save_duplicate(self, first_future, first_destination, first_link, link, destination) -> None:
+        """
+        Link a file already downloaded in this run (from another course or another URL of the same file)
+        """
+        first_future.result()
+        try:
+            if not os.path.exists(first_destination):
+                self._sync_file(link, destination)
+                return
+            link_or_copy(first_destination, destination)
+            # Left by an earlier interrupted download of this copy, which will never be resumed
+            remove_part(f"{destination}{PART_EXT}")
+            entry: Optional[ManifestEntry] = self.manifest.get(
+                first_link, self.manifest.relative_path(first_destination)) if self.manifest else None
+            if entry is not None:
+                self.manifest.record(replace(
+                    entry, url=link, path=self.manifest.relative_path(destination)))
+        except Exception as e:
+            logger.error("Could not save %s | %s", destination, str(e))
+
+    def _stream_to_file(self, link, destination, headers=None) -> Optional[ManifestEntry]:
+        """
+        Stream a download in chunks to destination.part, then move it to its destination once its size is verified
+        (memory usage does not depend on the file size, and no truncated file is ever left at the destination)
+        An interrupted download is resumed with a Range request on the next attempt, if the server sent validators
+        Returns None when a conditional request answers 304 Not Modified
+        """
+        part_path: str = f"{destination}{PART_EXT}"
+        resume: Optional[Dict] = get_resumable_part(link, part_path)
+        sha256 = hashlib.sha256()
+        offset, request_headers = get_request_headers(link, part_path, resume, headers)
+
+        with self.session.get(
+            link, params=self._download_params(link), headers=request_headers, verify=False, stream=True
+        ) as response:
+            if response.status_code == 416:
+                logger.info("Could not resume %s, downloading it again", destination)
+                remove_part(part_path)
+                return self._stream_to_file(link, destination, headers)
+            response.raise_for_status()
+            if response.status_code == 304:
+                return None
+
+            if is_resumed(response.status_code, response.headers, offset):
+                logger.info("Resuming %s at byte %s", destination, offset)
+                length: Optional[int] = resume["length"]
+                mode: str = "ab"
+                hash_file(part_path, sha256, self.chunk_size)
+                if self.progress is not None:
+                    self.progress.advance(offset)
+            else:
+                offset = 0
+                length = write_part_info(part_path, link, response.headers)
+                mode = "wb"
+
+            written: int = offset
+            try:
+                with open(part_path, mode, buffering=self.write_buffer_size) as write_file:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        write_file.write(chunk)
+                        sha256.update(chunk)
+                        written += len(chunk)
+                        if self.progress is not None:
+                            self.progress.advance(len(chunk))
+            except BaseException:
+                if get_resumable_part(link, part_path) is None:
+                    remove_part(part_path)
+                raise
+
+        promote(part_path, destination, written, length)
+        return ManifestEntry(
+            url=link,
+            path=destination,
+            size=written,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            sha256=sha256.hexdigest(),
+            received=written - offset,
+        )
 
-    def _get_next_wait_time(self) -> int:
+    def verify(self, hash_contents: bool = True, remote: bool = False, repair: bool = False,
+               processes: Optional[int] = None) -> VerifyReport:
         """
-        Scheduling downloads to avoid overloading the server (1 download every 2-5 seconds)
+        Check the saving directory against the manifest (sizes, and SHA-256 hashed in a process pool); with
+        `remote`, also against the files listed on Moodle (not downloaded, or changed since, from the sizes of
+        the webservice or HEAD requests); with `repair`, download again only the files with a problem
+        Raises FileNotFoundError when the saving directory or its manifest does not exist
         """
-        wait_time = self.wait_time
-        self.wait_time += randint(2, 5)
-        return wait_time
+        if self.manifest is None:
+            directory: str = self.get_saving_directory()
+            if not os.path.isdir(directory):
+                raise FileNotFoundError(f"The saving directory {directory} does not exist")
+            try:
+                self.manifest = Manifest(directory, create=False)
+            except FileNotFoundError:
+                raise FileNotFoundError(
+                    f"No manifest in {directory}: it is written by sync, run it first") from None
+        progress: Optional[Progress] = self.progress
+
+        def on_hashed(path, size) -> None:
+            progress.advance(size)
+            progress.done(path, size)
+
+        with self.metrics.stage("verify"):
+            report: VerifyReport = verify_archive(
+                self.manifest, hash_contents, processes,
+                on_queued=progress.expect if progress is not None else None,
+                on_hashed=on_hashed if progress is not None else None,
+            )
+        if progress is not None:
+            progress.close()
+            # The downloads of the repair have their own progress line
+            self.progress = Progress()
+        if remote or (repair and not report.ok):
+            self.login()
+        if remote:
+            self.courses = self.get_courses()
+            self.create_saving_directory()
+            self.get_files()
+            self._check_remote_files(report)
+        if repair:
+            self._repair(report)
+        self.clean_up_threads()
+        if repair:
+            self._check_repaired(report)
+        return report
+
+    def _check_remote_files(self, report: VerifyReport) -> None:
+        """
+        Files listed on Moodle that were never downloaded, or that changed since their download
+        """
+        # Every recorded copy of each URL
+        recorded: Dict[str, List[ManifestEntry]] = {}
+        for entry in self.manifest.entries():
+            recorded.setdefault(entry.url, []).append(entry)
+        damaged: Set[Tuple[str, str]] = {(entry.url, entry.path) for entry in report.damaged}
+        to_check: Dict[str, List[ManifestEntry]] = {}
+        checked: Set[str] = set()
+        for course, links in self.files.items():
+            for name, link in links.items():
+                if HTML_EXT in name or link in checked:
+                    continue
+                checked.add(link)
+                if link not in recorded:
+                    report.not_downloaded.append((course, name, link))
+                    continue
+                entries: List[ManifestEntry] = [
+                    entry for entry in recorded[link] if (entry.url, entry.path) not in damaged]
+                if self.webservice is not None and link in self.webservice.file_sizes:
+                    report.stale += [entry for entry in entries if is_stale_listing(
+                        entry, self.webservice.file_sizes[link], self.webservice.file_times.get(link))]
+                else:
+                    to_check[link] = entries
+
+        with self.metrics.stage("size_discovery"):
+            with ThreadPoolExecutor(max_workers=self.crawl_workers, thread_name_prefix="head") as executor:
+                links: List[str] = list(to_check)
+                for link, headers in zip(links, executor.map(self._get_remote_headers, links)):
+                    if headers is not None:
+                        report.stale += [entry for entry in to_check[link] if is_stale(entry, headers)]
+        logger.info("%s files on Moodle: %s not downloaded, %s changed since their download",
+                    sum(len(links) for links in self.files.values()), len(report.not_downloaded), len(report.stale))
+
+    def _repair(self, report: VerifyReport) -> None:
+        """
+        Queue the downloads of the missing, damaged, changed and never downloaded files only
+        """
+        self.create_saving_directory()
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="download")
+        for entry in report.damaged:
+            self._download_again(entry, damaged=True)
+        for entry in report.stale:
+            self._download_again(entry, damaged=False)
+        for course, name, link in report.not_downloaded:
+            self._save_file(course, self._create_course_directory(course), name, link)
+        logger.info("%s files queued for download", len(self.futures))
+
+    def _check_repaired(self, report: VerifyReport) -> None:
+        """
+        The files downloaded again by the repair that are still not recorded, or not on disk at their recorded size
+        """
+        # The copies with a problem are checked where they are recorded, the new files wherever they were saved
+        repaired: List[Tuple[str, Optional[str], str]] = [
+            (entry.url, entry.path, entry.path) for entry in report.damaged + report.stale]
+        repaired += [(link, None, f"{course}/{name}") for course, name, link in report.not_downloaded]
+        # The manifest of the run was closed with its downloads
+        manifest = Manifest(self.get_saving_directory(), create=False)
+        try:
+            for link, recorded_path, relative_path in repaired:
+                entry: Optional[ManifestEntry] = manifest.get(link, recorded_path)
+                destination: Optional[str] = manifest.absolute_path(entry) if entry is not None else None
+                if destination is None or not os.path.isfile(destination) \
+                        or os.path.getsize(destination) != entry.size:
+                    report.unrepaired.append(relative_path)
+        finally:
+            manifest.close()
+        if report.unrepaired:
+            logger.error("%s files could not be repaired", len(report.unrepaired))
+
+    def _download_again(self, entry: ManifestEntry, damaged: bool) -> None:
+        destination: str = self.manifest.absolute_path(entry)
+        if os.path.exists(destination):
+            # A damaged file hard linked from the blob store has damaged the stored copy too
+            if damaged and entry.sha256 and self.blobs is not None:
+                blob_path: str = self.blobs.path_for(entry.sha256)
+                if os.path.exists(blob_path) and os.path.samefile(blob_path, destination):
+                    os.remove(blob_path)
+            # Without the local copy, no conditional request is sent: the file is downloaded again
+            os.remove(destination)
+        pathlib.Path(os.path.dirname(destination)).mkdir(parents=True, exist_ok=True)
+        self.futures.append(self.executor.submit(
+            self._parallel_save_files,
+            current_path=os.path.dirname(destination),
+            name=os.path.basename(destination),
+            link=entry.url,
+        ))
+
+    def clean_up_threads(self) -> None:
+        logger.debug("Waiting for %s downloads to finish", len(self.futures))
+        try:
+            for future in self.futures:
+                try:
+                    future.result()
+                except CancelledError:
+                    pass
+        except KeyboardInterrupt:
+            if self.engine is not None:
+                self.engine.cancel()
+            raise
+        self.futures = []
+        if self.progress is not None:
+            self.progress.close()
+        if self.engine is not None:
+            self.engine.close()
+            self.engine = None
+        self.downloads_by_key = {}
+        if self.executor is not None and not self.shared_executor:
+            self.executor.shutdown()
+            self.executor = None
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+        if self.page_cache is not None:
+            self.page_cache.close()
+            self.page_cache = None
+
+
+def is_stale(entry: ManifestEntry, headers: Mapping[str, str]) -> bool:
+    """
+    Whether the headers of a file on Moodle show another version than the one recorded in the manifest
+    """
+    if entry.etag and headers.get("ETag"):
+        return comparable_etag(headers["ETag"]) != comparable_etag(entry.etag)
+    if entry.last_modified and headers.get("Last-Modified"):
+        return headers["Last-Modified"] != entry.last_modified
+    length: Optional[str] = headers.get("Content-Length")
+    return length is not None and length.isdigit() and int(length) != entry.size
+
+
+def is_stale_listing(entry: ManifestEntry, size: int, modified: Optional[int]) -> bool:
+    """
+    Whether the size and modification time (Unix time) listed by the web service show another version than
+    the one recorded in the manifest
+    """
+    if size != entry.size:
+        return True
+    if not modified or not entry.last_modified:
+        return False
+    try:
+        return modified > parsedate_to_datetime(entry.last_modified).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def comparable_etag(etag: str) -> str:
+    """
+    ETag without what servers add when they encode the same version differently: the weak prefix, and
+    Apache's -gzip / -br suffixes
+    """
+    return re.sub(r'-(?:gzip|br|deflate)"$', '"', etag.removeprefix("W/"))
 
 
 def get_valid_name(source_file_name):
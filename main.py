@@ -1,8 +1,124 @@
-from downloader import Downloader
+"""
+Command line of the scraper (the command defaults to sync):
+    python main.py [sync] [--config scraper.json | --batch batch.json]
+    python main.py login|list|verify [--config scraper.json]
+Each command imports what it uses: requests and the parsers are loaded by the commands that talk to Moodle,
+Selenium only by a login without a usable cached session, Jinja2 only by downloads of links
+"""
+import argparse
+import logging
+import sys
+
+CONFIG_FILE = "scraper.json"
+LOG_FILE = "moodle_scraper.log"
+
+
+def setup_logging(console_level: int, verbose: bool = False) -> None:
+    """
+    Log to moodle_scraper.log, and to the console from `console_level` (or debug messages with --verbose)
+    """
+    logging.basicConfig(filename=LOG_FILE, level=logging.DEBUG if verbose else logging.INFO)
+    console = logging.StreamHandler()
+    console.setLevel(logging.DEBUG if verbose else console_level)
+    console.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    logging.getLogger("moodle_scraper").addHandler(console)
+
+
+def get_downloader(args):
+    from downloader import Downloader, load_config
+    return Downloader(debugging=True, config=load_config(args.config))
+
+
+def login(args) -> int:
+    dl = get_downloader(args)
+    dl.login()
+    print(f"Logged in to {dl.moodle_url} as {dl.username}")
+    return 0
+
+
+def list_courses(args) -> int:
+    dl = get_downloader(args)
+    dl.login()
+    for course, link in dl.get_courses().items():
+        print(f"{course}\t{link}")
+    return 0
+
+
+def sync(args) -> int:
+    if args.batch:
+        from batch import BatchRunner, load_batch
+        BatchRunner(load_batch(args.batch)).run()
+    else:
+        get_downloader(args).run(show_welcome=sys.stdout.isatty())
+    return 0
+
+
+def verify(args) -> int:
+    dl = get_downloader(args)
+    try:
+        report = dl.verify(hash_contents=not args.quick, remote=args.remote, repair=args.repair,
+                           processes=args.processes)
+    except FileNotFoundError as e:
+        print(f"Cannot verify: {e}", file=sys.stderr)
+        return 1
+    for problem in ("missing", "truncated", "corrupted", "stale"):
+        for entry in getattr(report, problem):
+            print(f"{problem}\t{entry.path}")
+    for course, name, link in report.not_downloaded:
+        print(f"not downloaded\t{course}/{name}")
+    print(f"{report.checked} files checked ({report.hashed} hashed, {report.hashed_bytes / 1e6:.1f} MB): "
+          f"{len(report.missing)} missing, {len(report.truncated)} truncated, {len(report.corrupted)} corrupted, "
+          f"{len(report.stale)} stale, {len(report.not_downloaded)} not downloaded, "
+          f"{report.untracked} files not in the manifest")
+    if args.repair and not report.ok:
+        for path in report.unrepaired:
+            print(f"not repaired\t{path}")
+        print(f"{dl.downloaded_files} files downloaded again, {len(report.unrepaired)} not repaired")
+        return 1 if report.unrepaired else 0
+    return 0 if report.ok else 1
+
+
+COMMANDS = {
+    "login": (login, "log in and cache the session"),
+    "list": (list_courses, "list the courses of the account"),
+    "sync": (sync, "download the new and updated files of every course (default)"),
+    "verify": (verify, "check the saved files against the manifest (and Moodle with --remote)"),
+}
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Download the resources of your Moodle courses")
+    # Options given after the command do not reset those given before it
+    common = argparse.ArgumentParser(add_help=False)
+    for options_parser, default in ((parser, None), (common, argparse.SUPPRESS)):
+        options_parser.add_argument("--config", default=CONFIG_FILE if default is None else default,
+                                    help=f"settings of the account (default: {CONFIG_FILE})")
+        options_parser.add_argument("-v", "--verbose", action="store_true",
+                                    default=False if default is None else default, help="log debug messages")
+    parser.add_argument("--batch", metavar="FILE", help="archive every account listed in this batch file instead")
+    commands = parser.add_subparsers(dest="command", metavar="{" + ",".join(COMMANDS) + "}")
+    for name, (function, description) in COMMANDS.items():
+        command = commands.add_parser(name, parents=[common], help=description, description=description)
+        if name == "sync":
+            command.add_argument("--batch", metavar="FILE", default=argparse.SUPPRESS,
+                                 help="archive every account listed in this batch file instead")
+        if name == "verify":
+            command.add_argument("--quick", action="store_true", help="only compare the sizes, without hashing")
+            command.add_argument("--processes", type=int, help="hashing processes (default: one per CPU)")
+            command.add_argument("--remote", action="store_true",
+                                 help="also look for files changed on Moodle, or never downloaded")
+            command.add_argument("--repair", action="store_true",
+                                 help="download the missing, damaged and changed files again")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = get_parser().parse_args(argv)
+    command: str = args.command or "sync"
+    # The output of the other commands is not mixed with progress messages
+    setup_logging(logging.INFO if command == "sync" else logging.WARNING, args.verbose)
+    return COMMANDS[command][0](args)
+
 
 if __name__ == '__main__':
-    # set debug to True
-    dl = Downloader(
-        debugging=True
-    )
-    dl.run()
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import cProfile
+import logging
+import pstats
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("moodle_scraper")
+
+
+def endpoint(url: str) -> str:
+    """
+    Script of a Moodle URL, e.g. /pluginfile.php for every file download
+    """
+    path: str = urlsplit(url).path
+    match = re.match(r"^.*?\.php", path)
+    return match.group(0) if match else path or "/"
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class HttpStats:
+    """
+    Requests, retries and latencies (time to the response headers) per endpoint
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.retries_by_endpoint: Dict[str, int] = {}
+
+    def record(self, url: str, latency: float, retries: int = 0) -> None:
+        name: str = endpoint(url)
+        with self._lock:
+            self.latencies.setdefault(name, []).append(latency)
+            self.retries_by_endpoint[name] = self.retries_by_endpoint.get(name, 0) + retries
+
+    @property
+    def requests(self) -> int:
+        with self._lock:
+            return sum(len(latencies) for latencies in self.latencies.values())
+
+    @property
+    def retries(self) -> int:
+        with self._lock:
+            return sum(self.retries_by_endpoint.values())
+
+    def percentile(self, percent: float, name: Optional[str] = None) -> float:
+        """
+        Latency percentile of one endpoint, or of every request
+        """
+        with self._lock:
+            if name is not None:
+                latencies = list(self.latencies.get(name, []))
+            else:
+                latencies = [latency for values in self.latencies.values() for latency in values]
+        return percentile(latencies, percent)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            endpoints = {
+                name: {
+                    "requests": len(latencies),
+                    "retries": self.retries_by_endpoint[name],
+                    "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                    "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+                }
+                for name, latencies in sorted(self.latencies.items())
+            }
+        return {
+            "requests": sum(values["requests"] for values in endpoints.values()),
+            "retries": sum(values["retries"] for values in endpoints.values()),
+            "p50_ms": round(self.percentile(50) * 1000, 1),
+            "p95_ms": round(self.percentile(95) * 1000, 1),
+            "endpoints": endpoints,
+        }
+
+
+@dataclass
+class Stage:
+    calls: int = 0
+    # Summed over every thread running the stage
+    seconds: float = 0.0
+    first_start: Optional[float] = None
+    last_end: Optional[float] = None
+
+    @property
+    def wall_seconds(self) -> float:
+        """
+        From the first start to the last end of the stage
+        """
+        if self.first_start is None or self.last_end is None:
+            return 0.0
+        return self.last_end - self.first_start
+
+
+class Metrics:
+    """
+    Time spent in each stage of a run (stages can be nested and run in several threads at once),
+    HTTP statistics and downloaded bytes
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.start: float = time.perf_counter()
+        self.stages: Dict[str, Stage] = {}
+        self.http: HttpStats = HttpStats()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                stage = self.stages.setdefault(name, Stage())
+                stage.calls += 1
+                stage.seconds += end - start
+                stage.first_start = start if stage.first_start is None else min(stage.first_start, start)
+                stage.last_end = end if stage.last_end is None else max(stage.last_end, end)
+
+    def summary(self, files: int = 0, size: int = 0) -> Dict:
+        """
+        JSON-serialisable summary; the download throughput is measured over the wall time of the download stage
+        """
+        with self._lock:
+            stages = {
+                name: {
+                    "calls": stage.calls,
+                    "seconds": round(stage.seconds, 3),
+                    "wall_seconds": round(stage.wall_seconds, 3),
+                }
+                for name, stage in self.stages.items()
+            }
+            download_time: float = self.stages["download"].wall_seconds if "download" in self.stages else 0.0
+        return {
+            "wall_seconds": round(time.perf_counter() - self.start, 3),
+            "stages": stages,
+            "downloads": {
+                "files": files,
+                "bytes": size,
+                "bytes_per_second": round(size / download_time) if download_time else 0,
+            },
+            "http": self.http.summary(),
+        }
+
+
+class Profiler:
+    """
+    cProfile of the calling thread and of every thread started meanwhile, merged into one pstats file
+    (e.g. `python -m pstats <file>`); does nothing without a file
+    """
+
+    def __init__(self, file: Optional[str]):
+        self.file: Optional[str] = file
+        self.profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def _profile_thread(self, frame, event, arg) -> None:
+        # Called once, when a thread starts: replaced by a profiler of this thread
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python versions profiling every thread with the first profiler
+            return
+        with self._lock:
+            self.profiles.append(profile)
+
+    def __enter__(self):
+        if self.file:
+            self.profiles.append(cProfile.Profile())
+            threading.setprofile(self._profile_thread)
+            self.profiles[0].enable()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.file:
+            return
+        self.profiles[0].disable()
+        threading.setprofile(None)
+        with self._lock:
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+        stats.dump_stats(self.file)
+        logger.info("Profile of %s threads written to %s", len(self.profiles), self.file)
@@ -0,0 +1,170 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import aiohttp
+
+from monitoring.metrics import Metrics
+from network.rate_limiter import RateLimiter
+from storage.manifest import ManifestEntry
+from storage.parts import (PART_EXT, get_request_headers, get_resumable_part, hash_file, is_resumed, promote,
+                           remove_part, write_part_info)
+
+logger = logging.getLogger("moodle_scraper")
+
+
+class AsyncDownloadEngine:
+    """
+    Downloads on an asyncio event loop (aiohttp), running in one background thread: thousands of files can be
+    in flight with `connections` sockets (at most `connections_per_host` per host), while file writes go
+    to a small thread pool. Same semantics as Downloader._stream_to_file (conditional requests, .part files
+    resumed with Range requests, size verification)
+    """
+
+    def __init__(self, cookies: Dict[str, str], rate_limiter: RateLimiter, connections: int = 100,
+                 connections_per_host: int = 8, chunk_size: int = 64 * 1024,
+                 write_buffer_size: int = 1024 * 1024, file_workers: int = 2, metrics: Optional[Metrics] = None,
+                 on_progress: Optional[Callable[[int], None]] = None):
+        self.cookies: Dict[str, str] = cookies
+        self.rate_limiter: RateLimiter = rate_limiter
+        self.connections: int = connections
+        self.connections_per_host: int = connections_per_host
+        self.chunk_size: int = chunk_size
+        self.write_buffer_size: int = write_buffer_size
+        self.metrics: Metrics = metrics or Metrics()
+        # Called with the size of every chunk received (and of the resumed part of a file)
+        self.on_progress: Optional[Callable[[int], None]] = on_progress
+        self.file_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=file_workers, thread_name_prefix="files")
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="async-downloads", daemon=True)
+        self.thread.start()
+        self.session: aiohttp.ClientSession = asyncio.run_coroutine_threadsafe(
+            self._create_session(), self.loop).result()
+
+    async def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.connections, limit_per_host=self.connections_per_host, ssl=False)
+        return aiohttp.ClientSession(
+            connector=connector, cookies=self.cookies, cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300))
+
+    def submit(self, link: str, destination: str, headers: Optional[Dict[str, str]] = None,
+               params: Optional[Dict[str, str]] = None, on_done: Optional[Callable[[Optional[ManifestEntry]], None]] = None,
+               on_failed: Optional[Callable[[Exception], None]] = None) -> concurrent.futures.Future:
+        """
+        Schedule a download from any thread, with `params` added to its query (not logged); `on_done` receives its result (None when not modified), or
+        `on_failed` the error of a failed download, in the file thread pool
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._save(link, destination, headers, params, on_done, on_failed), self.loop)
+
+    async def _save(self, link, destination, headers, params, on_done, on_failed) -> Optional[ManifestEntry]:
+        try:
+            with self.metrics.stage("throttle"):
+                await asyncio.sleep(self.rate_limiter.reserve(link))
+            with self.metrics.stage("download"):
+                result = await self.download(link, destination, headers, params)
+        except Exception as e:
+            if on_failed is not None:
+                await self._in_file_thread(on_failed, e)
+            else:
+                logger.error("Could not download %s | %s", destination, str(e))
+            return None
+        if on_done is not None:
+            await self._in_file_thread(on_done, result)
+        return result
+
+    async def download(self, link, destination, headers=None, params=None) -> Optional[ManifestEntry]:
+        """
+        Returns None when a conditional request answers 304 Not Modified
+        """
+        part_path: str = f"{destination}{PART_EXT}"
+        resume: Optional[Dict] = await self._in_file_thread(get_resumable_part, link, part_path)
+        sha256 = hashlib.sha256()
+        offset, request_headers = get_request_headers(link, part_path, resume, headers)
+
+        start = time.perf_counter()
+        async with self.session.get(link, params=params, headers=request_headers) as response:
+            self.metrics.http.record(link, time.perf_counter() - start)
+            if response.status == 416:
+                logger.info("Could not resume %s, downloading it again", destination)
+                await self._in_file_thread(remove_part, part_path)
+                return await self.download(link, destination, headers, params)
+            response.raise_for_status()
+            if response.status == 304:
+                return None
+
+            if is_resumed(response.status, response.headers, offset):
+                logger.info("Resuming %s at byte %s", destination, offset)
+                length: Optional[int] = resume["length"]
+                mode: str = "ab"
+                await self._in_file_thread(hash_file, part_path, sha256, self.chunk_size)
+                if self.on_progress is not None:
+                    self.on_progress(offset)
+            else:
+                offset = 0
+                length = await self._in_file_thread(write_part_info, part_path, link, response.headers)
+                mode = "wb"
+
+            written: int = offset
+            buffer = bytearray()
+            write_file = await self._in_file_thread(open, part_path, mode)
+            try:
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    sha256.update(chunk)
+                    written += len(chunk)
+                    buffer += chunk
+                    if self.on_progress is not None:
+                        self.on_progress(len(chunk))
+                    if len(buffer) >= self.write_buffer_size:
+                        await self._in_file_thread(write_file.write, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await self._in_file_thread(write_file.write, bytes(buffer))
+            except BaseException:
+                # What was received is kept, so that the download resumes after it
+                try:
+                    if buffer:
+                        write_file.write(bytes(buffer))
+                finally:
+                    write_file.close()
+                if get_resumable_part(link, part_path) is None:
+                    remove_part(part_path)
+                raise
+            await self._in_file_thread(write_file.close)
+
+        await self._in_file_thread(promote, part_path, destination, written, length)
+        return ManifestEntry(
+            url=link,
+            path=destination,
+            size=written,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            sha256=sha256.hexdigest(),
+            received=written - offset,
+        )
+
+    async def _in_file_thread(self, function, *args):
+        return await self.loop.run_in_executor(self.file_executor, function, *args)
+
+    def cancel(self) -> None:
+        """
+        Cancel every pending download (partial files are kept to be resumed)
+        """
+        def cancel_tasks():
+            for task in asyncio.all_tasks(self.loop):
+                task.cancel()
+        self.loop.call_soon_threadsafe(cancel_tasks)
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.file_executor.shutdown()
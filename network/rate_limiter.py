@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("moodle_scraper")
+
+
+class RateLimiter:
+    """
+    Token bucket per host: at most `rate` requests per second, with bursts of up to `burst` requests
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate: float = rate
+        self.burst: int = max(1, burst)
+        self._lock = threading.Lock()
+        # host -> [available tokens, last refill time]
+        self._buckets: Dict[str, List[float]] = {}
+
+    def acquire(self, url: str) -> float:
+        """
+        Block until a request to the host of `url` is allowed, return the time waited
+        """
+        wait_time = self.reserve(url)
+        if wait_time:
+            logger.debug("Rate limiting %s: waiting %.2f seconds", urlsplit(url).netloc, wait_time)
+            time.sleep(wait_time)
+        return wait_time
+
+    def reserve(self, url: str) -> float:
+        """
+        Reserve a request to the host of `url`, return how long to wait before sending it
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(host, [float(self.burst), now])
+            tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+            # Reserve a token even if it is not available yet: callers are served in arrival order
+            tokens -= 1
+            self._buckets[host] = [tokens, now]
+            return -tokens / self.rate if tokens < 0 else 0.0
+
+
+class HostLimiter:
+    """
+    At most `limit` requests in flight per host (0: no limit), shared by every user of the limiter
+    """
+
+    def __init__(self, limit: int):
+        self.limit: int = limit
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        if self.limit <= 0:
+            yield
+            return
+
+        host = urlsplit(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.setdefault(
+                host, threading.BoundedSemaphore(self.limit))
+        with semaphore:
+            yield
+
+    def record(self, url: str, status: int, latency: Optional[float], retry_after: Optional[float] = None) -> None:
+        """
+        Feedback of a response, ignored: the limit is fixed
+        """
+
+
+class AdaptiveLimiter:
+    """
+    Concurrent requests per host adapted to the server (AIMD): the limit doubles after each window of fast
+    responses until the first sign of congestion, then grows by one per window; it is halved (at most once
+    per window) on 429 or 503 answers or when the latency rises above `latency_factor` times the lowest
+    smoothed latency seen plus `latency_margin` seconds, and new requests wait for Retry-After. It stays
+    between 1 and `max_limit`
+    """
+
+    def __init__(self, max_limit: int, initial_limit: int = 2, latency_factor: float = 1.5,
+                 latency_margin: float = 0.05):
+        self.max_limit: int = max(1, max_limit)
+        self.initial_limit: int = max(1, min(initial_limit, self.max_limit))
+        self.latency_factor: float = latency_factor
+        # Without it, the jitter of a fast server (a few milliseconds over a lowest latency of a few
+        # milliseconds) would be taken for congestion
+        self.latency_margin: float = latency_margin
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, _HostState] = {}
+
+    def _host(self, url: str) -> "_HostState":
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = _HostState(host, float(self.initial_limit))
+            return self._hosts[host]
+
+    def limit(self, url: str) -> int:
+        return int(self._host(url).limit)
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        state = self._host(url)
+        with state.condition:
+            while True:
+                paused = state.paused_until - time.monotonic()
+                if paused > 0:
+                    state.condition.wait(paused)
+                elif state.in_flight >= int(state.limit):
+                    state.condition.wait()
+                else:
+                    break
+            state.in_flight += 1
+        try:
+            yield
+        finally:
+            with state.condition:
+                state.in_flight -= 1
+                state.condition.notify()
+
+    def record(self, url: str, status: int, latency: Optional[float], retry_after: Optional[float] = None) -> None:
+        """
+        Feedback of a response: its status, its latency (time to the headers, None when unknown)
+        and its Retry-After header
+        """
+        state = self._host(url)
+        with state.condition:
+            now = time.monotonic()
+            if retry_after:
+                state.paused_until = max(state.paused_until, now + retry_after)
+                logger.debug("Throttling %s: HTTP %s, pausing for %.1f seconds", state.host, status, retry_after)
+            if latency is not None and now - latency < state.decreased_at:
+                # Sent before the last decrease, this response says nothing about the current limit
+                return
+
+            throttled: bool = status in (429, 503)
+            if latency is not None and not throttled:
+                state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+                # The lowest latency slowly drifts up, so that a slower server is not mistaken for congestion forever
+                state.base_latency = min(state.latency, state.base_latency * 1.001)
+
+            reason: Optional[str] = None
+            if throttled:
+                reason = f"HTTP {status}"
+            elif state.latency is not None and \
+                    state.latency > self.latency_factor * state.base_latency + self.latency_margin:
+                reason = f"latency {state.latency * 1000:.0f} ms (lowest {state.base_latency * 1000:.0f} ms)"
+
+            previous = int(state.limit)
+            if reason is not None:
+                state.slow_start = False
+                # One decrease per window: the 429/503 answers to requests sent before it carry the same signal
+                if now >= state.hold_until:
+                    state.limit = max(1.0, state.limit / 2)
+                    state.hold_until = now + max(state.latency or 0.0, 0.1)
+                    state.decreased_at = now
+                    # The latency is measured again at the new limit
+                    state.latency = None
+                    state.successes = 0
+                    if int(state.limit) != previous:
+                        logger.info("Throttling %s: %s, %s -> %s concurrent requests",
+                                    state.host, reason, previous, int(state.limit))
+                return
+
+            state.successes += 1
+            if state.successes >= int(state.limit):
+                state.successes = 0
+                state.limit = min(float(self.max_limit),
+                                  state.limit * 2 if state.slow_start else state.limit + 1)
+                if int(state.limit) != previous:
+                    logger.info("Throttling %s: latency %.0f ms, %s -> %s concurrent requests",
+                                state.host, (state.latency or 0.0) * 1000, previous, int(state.limit))
+                    state.condition.notify_all()
+
+
+@dataclass
+class _HostState:
+    host: str
+    limit: float
+    condition: threading.Condition = field(default_factory=threading.Condition)
+    in_flight: int = 0
+    # Fast responses since the last change of the limit
+    successes: int = 0
+    slow_start: bool = True
+    # Smoothed latency, and the lowest one seen
+    latency: Optional[float] = None
+    base_latency: float = float("inf")
+    paused_until: float = 0.0
+    hold_until: float = 0.0
+    decreased_at: float = 0.0
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds to wait from a Retry-After header (a number of seconds or an HTTP date)
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,54 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("moodle_scraper")
+
+
+class SessionCache:
+    """
+    Cookies harvested by the Selenium login, saved on disk (readable by the owner only) until they expire
+    """
+
+    def __init__(self, file: str, max_age: float):
+        self.file: str = file
+        self.max_age: float = max_age
+
+    def load(self) -> Optional[List[Dict]]:
+        if not self.file or not os.path.exists(self.file):
+            return None
+        try:
+            with open(self.file, "r", encoding="utf-8") as read_file:
+                cache = json.load(read_file)
+        except (OSError, ValueError) as e:
+            logger.info("Ignoring unreadable session cache %s | %s", self.file, e)
+            return None
+
+        if cache.get("expires", 0) <= time.time():
+            logger.info("Cached session has expired")
+            self.clear()
+            return None
+        return cache.get("cookies") or None
+
+    def save(self, cookies: List[Dict]) -> None:
+        if not self.file:
+            return
+        expires = time.time() + self.max_age
+        # Selenium cookies have an "expiry" timestamp unless they only last for the browser session
+        for cookie in cookies:
+            if cookie.get("expiry"):
+                expires = min(expires, cookie["expiry"])
+        cache = {
+            "expires": expires,
+            "cookies": [{"name": c["name"], "value": c["value"]} for c in cookies],
+        }
+        fd = os.open(self.file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w", encoding="utf-8") as write_file:
+            json.dump(cache, write_file)
+        logger.info("Saved session cookies to %s", self.file)
+
+    def clear(self) -> None:
+        if self.file and os.path.exists(self.file):
+            os.remove(self.file)
@@ -0,0 +1,65 @@
+import logging
+import re
+from typing import List, Optional
+from urllib.parse import parse_qs, parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+logger = logging.getLogger("moodle_scraper")
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER: str = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Only the parts of the pages that are read are parsed (and kept in memory)
+COURSE_LIST = SoupStrainer(id="nav-drawer")
+COURSE_PAGE = SoupStrainer(
+    class_=["activityinstance", "no-overflow", "fp-filename-icon",
+            # Links to the section pages of courses showing one section per page
+            "sectionname", "section-title", "section-navigation"])
+NESTED_PAGE = SoupStrainer(class_="fileuploadsubmission")
+# Moodle adds the course of a page to the classes of its body, e.g. <body class="... course-12 ...">
+BODY_COURSE = re.compile(r'<body\b[^>]*\bclass="[^"]*\bcourse-(\d+)\b')
+
+
+def parse_page(text: str, only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+    """
+    Parse a Moodle page with lxml when it is installed, restricted to the `only` subtrees
+    """
+    return BeautifulSoup(text, HTML_PARSER, parse_only=only)
+
+
+def canonical_url(link: str) -> str:
+    """
+    `link` without its fragment and with a sorted query, so that links to the same page compare equal
+    """
+    url = urlsplit(link)
+    return urlunsplit(url._replace(query=urlencode(sorted(parse_qsl(url.query))), fragment=""))
+
+
+def page_course(text: str) -> Optional[str]:
+    """
+    Id of the course a page belongs to, from the classes of its body (None if it does not show one)
+    """
+    match = BODY_COURSE.search(text)
+    return match.group(1) if match else None
+
+
+def section_links(soup: BeautifulSoup, course_link: str) -> List[str]:
+    """
+    Canonical links of a course page to the sections of the course at `course_link`:
+    course/view.php?id=<course>&section=N, or course/section.php?id=<section> since Moodle 4.4 (whose
+    course is only known from the page itself, see page_course)
+    """
+    course_id = parse_qs(urlsplit(course_link).query).get("id")
+    links: List[str] = []
+    for a_tag in soup.find_all("a", href=True):
+        link = urljoin(course_link, a_tag["href"])
+        url = urlsplit(link)
+        query = parse_qs(url.query)
+        if (url.path.endswith("/course/view.php") and "section" in query and query.get("id") == course_id
+                or url.path.endswith("/course/section.php") and "id" in query):
+            links.append(canonical_url(link))
+    return links
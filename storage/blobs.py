@@ -0,0 +1,94 @@
+import logging
+import os
+import re
+import shutil
+import threading
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("moodle_scraper")
+
+BLOBS_NAME: str = ".moodlescrap-blobs"
+
+
+def pluginfile_key(url: str) -> str:
+    """
+    Identify the Moodle file behind a download link: the web service and browser URLs of a pluginfile
+    item only differ by their query (forcedownload, token) and the /webservice prefix
+    """
+    split = urlsplit(url)
+    if "/pluginfile.php/" not in split.path:
+        return url
+    return f"{split.netloc}{re.sub(r'/webservice/pluginfile.php/', '/pluginfile.php/', split.path)}"
+
+
+class BlobStore:
+    """
+    Content-addressed store (by SHA-256) in the saving directory: files with the same content, in any
+    course, are hard links to a single copy
+    """
+
+    def __init__(self, directory: str):
+        self.directory: str = os.path.join(directory, BLOBS_NAME)
+        # A blob is not released while another download links to it
+        self._lock = threading.RLock()
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    def store(self, file_path: str, sha256: str) -> bool:
+        """
+        Add a downloaded file to the store; return True if its content was already there,
+        in which case the file is replaced by a link to the stored copy
+        """
+        with self._lock:
+            return self._store(file_path, sha256)
+
+    def _store(self, file_path: str, sha256: str) -> bool:
+        blob_path = self.path_for(sha256)
+        if os.path.exists(blob_path):
+            if not os.path.samefile(blob_path, file_path):
+                link_or_copy(blob_path, file_path)
+                logger.info("Deduplicated %s", file_path)
+            return True
+
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        try:
+            os.link(file_path, blob_path)
+        except FileExistsError:
+            # Stored by another download in the meantime
+            return self._store(file_path, sha256)
+        except OSError as e:
+            logger.debug("Could not add %s to the blob store | %s", file_path, e)
+        return False
+
+    def release(self, sha256: str) -> bool:
+        """
+        Remove the stored copy of a content no file links to anymore (e.g. the previous version of a file
+        updated on Moodle); return True if it was removed
+        """
+        blob_path = self.path_for(sha256)
+        with self._lock:
+            try:
+                if os.stat(blob_path).st_nlink > 1:
+                    return False
+                os.remove(blob_path)
+            except OSError:
+                return False
+        logger.debug("Removed the unused blob %s", sha256)
+        return True
+
+
+def link_or_copy(source: str, destination: str) -> None:
+    """
+    Atomically replace destination by a hard link to source, or by a copy where hard links are not supported
+    """
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+    temp_path = f"{destination}.link"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copy2(source, temp_path)
+    os.replace(temp_path, destination)
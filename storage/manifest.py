@@ -0,0 +1,116 @@
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("moodle_scraper")
+
+MANIFEST_NAME: str = ".moodlescrap-manifest.sqlite"
+
+
+@dataclass
+class ManifestEntry:
+    url: str
+    # Path relative to the saving directory
+    path: str
+    size: int
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    sha256: Optional[str] = None
+    # Bytes received by the download that produced this entry (less than size when it was resumed), not recorded
+    received: Optional[int] = field(default=None, compare=False)
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class Manifest:
+    """
+    Persistent record of every downloaded file (Moodle URL and local path -> size, validators and hash),
+    stored in the saving directory so that later runs only transfer what changed; a URL listed in several
+    courses has one record per copy
+    """
+
+    def __init__(self, directory: str, create: bool = True):
+        """
+        Without `create`, a missing manifest raises FileNotFoundError instead of starting an empty one
+        """
+        self.directory: str = directory
+        self.file: str = os.path.join(directory, MANIFEST_NAME)
+        if not create and not os.path.isfile(self.file):
+            raise FileNotFoundError(f"No manifest in {directory}")
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.file, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        keys: List[str] = [row[1] for row in self._connection.execute("PRAGMA table_info(files)") if row[5]]
+        if keys == ["url"]:
+            # Manifests written before copies were recorded: one record per URL
+            self._connection.execute("ALTER TABLE files RENAME TO files_by_url")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "url TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, "
+            "etag TEXT, last_modified TEXT, sha256 TEXT, PRIMARY KEY (url, path))"
+        )
+        if keys == ["url"]:
+            self._connection.execute("INSERT INTO files SELECT url, path, size, etag, last_modified, sha256 "
+                                     "FROM files_by_url")
+            self._connection.execute("DROP TABLE files_by_url")
+        self._connection.commit()
+
+    def get(self, url: str, path: Optional[str] = None) -> Optional[ManifestEntry]:
+        """
+        Record of the copy of `url` at `path` (relative to the saving directory), or of its first copy
+        """
+        with self._lock:
+            if path is None:
+                row = self._connection.execute(
+                    "SELECT url, path, size, etag, last_modified, sha256 FROM files WHERE url = ? "
+                    "ORDER BY rowid LIMIT 1", (url,)
+                ).fetchone()
+            else:
+                row = self._connection.execute(
+                    "SELECT url, path, size, etag, last_modified, sha256 FROM files WHERE url = ? AND path = ?",
+                    (url, path)
+                ).fetchone()
+        return ManifestEntry(*row) if row else None
+
+    def record(self, entry: ManifestEntry) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files (url, path, size, etag, last_modified, sha256) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (entry.url, entry.path, entry.size, entry.etag, entry.last_modified, entry.sha256),
+            )
+            self._connection.commit()
+
+    def remove(self, entry: ManifestEntry) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM files WHERE url = ? AND path = ?", (entry.url, entry.path))
+            self._connection.commit()
+
+    def entries(self) -> List[ManifestEntry]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT url, path, size, etag, last_modified, sha256 FROM files").fetchall()
+        return [ManifestEntry(*row) for row in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def absolute_path(self, entry: ManifestEntry) -> str:
+        return os.path.join(self.directory, entry.path)
+
+    def relative_path(self, file_path: str) -> str:
+        return os.path.relpath(file_path, self.directory)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
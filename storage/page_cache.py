@@ -0,0 +1,109 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+logger = logging.getLogger("moodle_scraper")
+
+PAGE_CACHE_NAME: str = ".moodlescrap-pages.sqlite"
+
+
+@dataclass
+class CachedPage:
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # What was extracted from the page (files, paragraphs, links), as stored by the crawler
+    result: Dict
+    fetched_at: float
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """
+    What was extracted from the course and assignment pages of previous runs, keyed by URL, with the
+    validators of each page: pages younger than `ttl` seconds are not requested at all, older ones are
+    revalidated with a conditional request. The least recently used pages are evicted beyond `max_size` bytes
+    """
+
+    def __init__(self, file: str, ttl: float = 0, max_size: int = 32 * 1024 * 1024):
+        self.file: str = file
+        self.ttl: float = ttl
+        self.max_size: int = max_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.file, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, result TEXT NOT NULL, "
+            "size INTEGER NOT NULL, fetched_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS pages_used_at ON pages (used_at)")
+        self._connection.commit()
+        self._size: int = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT url, etag, last_modified, result, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE pages SET used_at = ? WHERE url = ?", (time.time(), url))
+            self._connection.commit()
+        return CachedPage(row[0], row[1], row[2], json.loads(row[3]), row[4])
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return time.time() - page.fetched_at < self.ttl
+
+    def put(self, url: str, etag: Optional[str], last_modified: Optional[str], result: Dict) -> None:
+        value: str = json.dumps(result)
+        now: float = time.time()
+        with self._lock:
+            previous = self._connection.execute("SELECT size FROM pages WHERE url = ?", (url,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pages (url, etag, last_modified, result, size, fetched_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, value, len(value), now, now),
+            )
+            self._size += len(value) - (previous[0] if previous else 0)
+            if self._size > self.max_size:
+                self._evict()
+            self._connection.commit()
+
+    def refresh(self, url: str) -> None:
+        """
+        The page was revalidated (304 Not Modified): it is fresh again
+        """
+        with self._lock:
+            self._connection.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+            self._connection.commit()
+
+    def _evict(self) -> None:
+        rows = self._connection.execute("SELECT url, size FROM pages ORDER BY used_at").fetchall()
+        evicted = []
+        for url, size in rows:
+            if self._size <= self.max_size:
+                break
+            evicted.append((url,))
+            self._size -= size
+        self._connection.executemany("DELETE FROM pages WHERE url = ?", evicted)
+        logger.debug("Evicted %s pages from the page cache", len(evicted))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,84 @@
+import json
+import os
+from typing import Dict, Mapping, Optional, Tuple
+
+# Partial downloads, and the information needed to resume them (expected length and validators)
+PART_EXT = ".part"
+PART_INFO_EXT = ".json"
+
+
+def get_resumable_part(link: str, part_path: str) -> Optional[Dict]:
+    """
+    Information recorded for a partial download, if it can be resumed
+    """
+    if not os.path.exists(part_path):
+        return None
+    try:
+        with open(f"{part_path}{PART_INFO_EXT}", "r", encoding="utf-8") as read_file:
+            info: Dict = json.load(read_file)
+    except (OSError, ValueError):
+        return None
+    if info.get("url") != link or not info.get("length") or not (info.get("etag") or info.get("last_modified")):
+        return None
+    if os.path.getsize(part_path) >= info["length"]:
+        return None
+    return info
+
+
+def get_request_headers(link: str, part_path: str, resume: Optional[Dict],
+                    headers: Optional[Dict[str, str]]) -> Tuple[int, Dict[str, str]]:
+    """
+    Offset and headers of a download: a Range request when resuming, the conditional headers otherwise
+    """
+    # Files are not compressed in transit: their Content-Length and byte ranges are those of the file on disk
+    result: Dict[str, str] = {"referer": link, "Accept-Encoding": "identity"}
+    if resume is None:
+        result.update(headers or {})
+        return 0, result
+    offset: int = os.path.getsize(part_path)
+    # If-Range: the server sends the whole file instead of the range if it changed since
+    result["Range"] = f"bytes={offset}-"
+    result["If-Range"] = resume["etag"] or resume["last_modified"]
+    return offset, result
+
+
+def is_resumed(status: int, response_headers: Mapping[str, str], offset: int) -> bool:
+    return status == 206 and response_headers.get("Content-Range", "").startswith(f"bytes {offset}-")
+
+
+def write_part_info(part_path: str, link: str, response_headers: Mapping[str, str]) -> Optional[int]:
+    """
+    Record what is needed to resume a new download, return its expected length
+    """
+    length = int(response_headers["Content-Length"]) if "Content-Length" in response_headers else None
+    with open(f"{part_path}{PART_INFO_EXT}", "w", encoding="utf-8") as write_file:
+        json.dump({
+            "url": link,
+            "length": length,
+            "etag": response_headers.get("ETag"),
+            "last_modified": response_headers.get("Last-Modified"),
+        }, write_file)
+    return length
+
+
+def promote(part_path: str, destination: str, written: int, length: Optional[int]) -> None:
+    """
+    Move a finished download to its destination, once its size is verified
+    """
+    if length is not None and written != length:
+        raise IOError(
+            f"Incomplete download of {destination}: {written} of {length} bytes, will resume on the next run")
+    os.replace(part_path, destination)
+    remove_part(part_path)
+
+
+def remove_part(part_path: str) -> None:
+    for file_path in (part_path, f"{part_path}{PART_INFO_EXT}"):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def hash_file(file_path: str, sha256, chunk_size: int) -> None:
+    with open(file_path, "rb") as read_file:
+        for chunk in iter(lambda: read_file.read(chunk_size), b""):
+            sha256.update(chunk)
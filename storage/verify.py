@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from storage.manifest import Manifest, ManifestEntry
+from storage.parts import PART_EXT, PART_INFO_EXT
+
+logger = logging.getLogger("moodle_scraper")
+
+# Files of the scraper in the saving directory (manifest, page cache, blob store) start with this
+INTERNAL_PREFIX: str = ".moodlescrap"
+HASH_BUFFER_SIZE: int = 1024 * 1024
+# One task of the process pool hashes up to this many files, or this many bytes, to keep the
+# inter-process overhead low with many small files while large files are spread over the processes
+BATCH_FILES: int = 256
+BATCH_BYTES: int = 64 * 1024 * 1024
+
+
+@dataclass
+class VerifyReport:
+    checked: int = 0
+    hashed: int = 0
+    hashed_bytes: int = 0
+    # Recorded in the manifest but not on disk
+    missing: List[ManifestEntry] = field(default_factory=list)
+    # Smaller or larger on disk than recorded
+    truncated: List[ManifestEntry] = field(default_factory=list)
+    # Same size but another SHA-256 than recorded (or unreadable)
+    corrupted: List[ManifestEntry] = field(default_factory=list)
+    # Changed on Moodle since it was downloaded
+    stale: List[ManifestEntry] = field(default_factory=list)
+    # Listed on Moodle but never downloaded: (course, name, link)
+    not_downloaded: List[Tuple[str, str, str]] = field(default_factory=list)
+    # Files on disk that are not in the manifest (course information, links, files of older versions)
+    untracked: int = 0
+    # Paths still with a problem after a repair (download failed)
+    unrepaired: List[str] = field(default_factory=list)
+
+    @property
+    def damaged(self) -> List[ManifestEntry]:
+        return self.missing + self.truncated + self.corrupted
+
+    @property
+    def ok(self) -> bool:
+        return not (self.damaged or self.stale or self.not_downloaded)
+
+
+def sha256_of(path: str, buffer_size: int = HASH_BUFFER_SIZE) -> str:
+    """
+    SHA-256 of a file read in chunks into one reused buffer (memory does not depend on the file size)
+    """
+    sha256 = hashlib.sha256()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as read_file:
+        while True:
+            size: int = read_file.readinto(buffer)
+            if not size:
+                break
+            sha256.update(view[:size])
+    return sha256.hexdigest()
+
+
+def _hash_batch(paths: List[str]) -> List[Tuple[str, Optional[str]]]:
+    results: List[Tuple[str, Optional[str]]] = []
+    for path in paths:
+        try:
+            results.append((path, sha256_of(path)))
+        except OSError:
+            results.append((path, None))
+    return results
+
+
+def scan_directory(directory: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Relative path -> (size, inode) of every file of the archive, without the files of the scraper and the
+    partial downloads
+    """
+    files: Dict[str, Tuple[int, int]] = {}
+    directories: List[str] = [directory]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith(INTERNAL_PREFIX):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(
+                        (PART_EXT, f"{PART_EXT}{PART_INFO_EXT}")):
+                    files[os.path.relpath(entry.path, directory)] = (
+                        entry.stat(follow_symlinks=False).st_size, entry.inode())
+    return files
+
+
+def hash_files(files: List[Tuple[str, int]], processes: Optional[int] = None,
+               on_hashed: Optional[Callable[[str, int], None]] = None) -> Dict[str, Optional[str]]:
+    """
+    SHA-256 of (path, size) files in a pool of `processes` processes (default: one per CPU, 1: in this
+    process), largest files first; None for unreadable files
+    """
+    sizes: Dict[str, int] = dict(files)
+    batches: List[List[str]] = []
+    batch: List[str] = []
+    batch_size: int = 0
+    for path, size in sorted(files, key=lambda file: file[1], reverse=True):
+        batch.append(path)
+        batch_size += size
+        if len(batch) >= BATCH_FILES or batch_size >= BATCH_BYTES:
+            batches.append(batch)
+            batch, batch_size = [], 0
+    if batch:
+        batches.append(batch)
+
+    digests: Dict[str, Optional[str]] = {}
+
+    def collect(results: List[Tuple[str, Optional[str]]]) -> None:
+        for path, digest in results:
+            digests[path] = digest
+            if on_hashed is not None:
+                on_hashed(path, sizes[path])
+
+    if processes == 1 or len(batches) <= 1:
+        for batch in batches:
+            collect(_hash_batch(batch))
+        return digests
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures: List[Future] = [executor.submit(_hash_batch, batch) for batch in batches]
+        for future in as_completed(futures):
+            collect(future.result())
+    return digests
+
+
+def verify_archive(manifest: Manifest, hash_contents: bool = True, processes: Optional[int] = None,
+                   on_queued: Optional[Callable[[str, int], None]] = None,
+                   on_hashed: Optional[Callable[[str, int], None]] = None) -> VerifyReport:
+    """
+    Compare the files recorded in the manifest with the saving directory: sizes first, from one walk of the
+    directory, then (with `hash_contents`) the SHA-256 of the files of the right size, each file (inode) once
+    even when it is hard linked into several courses
+    """
+    files: Dict[str, Tuple[int, int]] = scan_directory(manifest.directory)
+    report = VerifyReport()
+    tracked: Set[str] = set()
+    # Path of the first file of each inode -> entries to compare with its hash
+    to_hash: Dict[str, List[ManifestEntry]] = {}
+    first_path: Dict[Union[int, str], str] = {}
+    sizes: Dict[str, int] = {}
+    for entry in manifest.entries():
+        report.checked += 1
+        path: str = os.path.normpath(entry.path)
+        tracked.add(path)
+        found: Optional[Tuple[int, int]] = files.get(path)
+        if found is None:
+            report.missing.append(entry)
+        elif found[0] != entry.size:
+            report.truncated.append(entry)
+        elif hash_contents and entry.sha256:
+            size, inode = found
+            # Some file systems have no inode numbers (0)
+            absolute_path: str = first_path.setdefault(inode or path, manifest.absolute_path(entry))
+            to_hash.setdefault(absolute_path, []).append(entry)
+            sizes[absolute_path] = size
+    report.untracked = len(files.keys() - tracked)
+
+    if on_queued is not None:
+        for path, size in sizes.items():
+            on_queued(path, size)
+    digests: Dict[str, Optional[str]] = hash_files(list(sizes.items()), processes, on_hashed)
+    for path, entries in to_hash.items():
+        report.hashed += 1
+        report.hashed_bytes += sizes[path]
+        for entry in entries:
+            if digests.get(path) != entry.sha256:
+                report.corrupted.append(entry)
+    logger.info("Verified %s files (%s hashed, %.1f MB): %s missing, %s truncated, %s corrupted",
+                report.checked, report.hashed, report.hashed_bytes / 1e6,
+                len(report.missing), len(report.truncated), len(report.corrupted))
+    return report
@@ -1,3 +1,9 @@
+import sys
+import threading
+import time
+from typing import Dict, Optional, TextIO
+
+
 class colors:
     HEADER = '\033[95m'
     OKBLUE = '\033[94m'
@@ -9,13 +15,6 @@ class colors:
 
 
 def welcome():
-
-    # 1. Clear the console
-    # 2. Print the welcome message
-
-    import os
-    os.system('cls' if os.name == 'nt' else 'clear')
-
     print(colors.HEADER)
     print("      _____                    .___.__              ")
     print("     /     \   ____   ____   __| _/|  |   ____      ")
@@ -30,3 +29,105 @@ def welcome():
     print("/_______  /\___  >__|  (____  /   __/ \___  >__|    ")
     print("        \/     \/           \/|__|        \/        ")
     print(colors.ENDC)
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1000 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1000
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+class Progress:
+    """
+    Live progress of the downloads on one terminal line: bytes received out of the expected total, throughput
+    and ETA (once the size of every queued file is known), redrawn at most every `interval` seconds
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, interval: float = 0.5, width: int = 24):
+        self.stream: TextIO = stream or sys.stderr
+        self.interval: float = interval
+        self.width: int = width
+        self._lock = threading.Lock()
+        self.start: float = time.perf_counter()
+        self._drawn_at: float = 0.0
+        # Expected size of each queued download (None: unknown), until it is done
+        self.expected: Dict[str, Optional[int]] = {}
+        self.files: int = 0
+        self.files_done: int = 0
+        self.unknown: int = 0
+        self.total: int = 0
+        self.received: int = 0
+
+    def expect(self, link: str, size: Optional[int]) -> None:
+        with self._lock:
+            if link in self.expected:
+                return
+            if not self.files:
+                # The throughput is measured from the first download queued, not from the login
+                self.start = time.perf_counter()
+            self.expected[link] = size
+            self.files += 1
+            if size is None:
+                self.unknown += 1
+            else:
+                self.total += size
+
+    def advance(self, size: int) -> None:
+        with self._lock:
+            self.received += size
+            self._draw()
+
+    def done(self, link: str, size: int) -> None:
+        """
+        A download is over: `size` bytes were received for it (0 when it was not modified), whatever was expected
+        """
+        with self._lock:
+            if link not in self.expected:
+                return
+            expected: Optional[int] = self.expected.pop(link)
+            self.files_done += 1
+            if expected is None:
+                self.unknown -= 1
+                self.total += size
+            else:
+                self.total += size - expected
+            self._draw()
+
+    def line(self) -> str:
+        elapsed: float = time.perf_counter() - self.start
+        rate: float = self.received / elapsed if elapsed else 0.0
+        parts = [f"{format_size(self.received)}"]
+        if not self.unknown and self.total:
+            ratio: float = min(1.0, self.received / self.total)
+            filled: int = int(ratio * self.width)
+            bar: str = "#" * filled + "-" * (self.width - filled)
+            parts = [f"{colors.OKBLUE}[{bar}]{colors.ENDC} {ratio:4.0%}",
+                     f"{format_size(self.received)} / {format_size(self.total)}"]
+        parts.append(f"{format_size(rate)}/s")
+        if not self.unknown and rate:
+            parts.append(f"ETA {format_duration(max(0, self.total - self.received) / rate)}")
+        parts.append(f"{self.files_done}/{self.files} files")
+        return "  ".join(parts)
+
+    def _draw(self, force: bool = False) -> None:
+        now: float = time.perf_counter()
+        if not force and now - self._drawn_at < self.interval:
+            return
+        self._drawn_at = now
+        # The cursor goes back to the start of the line, so that log messages overwrite the progress line
+        self.stream.write(f"\r\033[K{self.line()}\r")
+        self.stream.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self.files:
+                self._draw(force=True)
+                self.stream.write("\n")
+                self.stream.flush()